@@ -26,23 +26,36 @@
 #
 
 import sys
+
+# The import profile of --startup-profile has to start before anything else is imported
+if "--startup-profile" in sys.argv:
+    from utils.ImportProfiler import ImportProfiler
+    ImportProfiler.start()
+
 import os
 from os import path
 import time
-import json
 import functools
-import platform
-
-import dominate
-from dominate.tags import table, tr, td, th, span
+import io
+import gzip
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 #  Import local Python libraries
 # from operators import SMBShares, NFSExports, DirQuotas, Replications
 from utils.Logger import Logger
 from utils import ArgParsing
 from utils import Authentication
-from utils.Email import Email
+from utils import Metrics
 from utils.ConfigFileParser import ConfigFileParser
+from utils.ConnectionPool import ConnectionPool
+from utils.History import open_history, DAY
+from utils.PathTrie import PathTrie
+from utils.Report import ReportWriter, ReportTable, REPORT_WRITERS, TopRows
+from utils.Routing import RouteTable, OwnerReports
+from utils.Scheduler import IntervalSchedule, CronSchedule, run_forever
 
 
 # Define the name of the Program, Description, and Version.
@@ -52,179 +65,798 @@ progvers = "6.1.0"
 
 logger = Logger()
 
-def check_capacity(args, rc):
-    CONFIG_FILE_PATH = args.config_file
-    with open(CONFIG_FILE_PATH, "r") as configFile:
-        config = json.load(configFile)
-        dir_capacity_usages = []
-
-        all_quota_details = []    
-        next_page = "first"
-        while next_page != "":
-            r = None
-            if next_page == "first":
-                try:
-                    r = list(rc.quota.get_all_quotas_with_status(page_size=1000))[0]
-                except (Exception,):
-                    next
-            else:
-                r = rc.request("GET", next_page)
-            if not r:
-                break
-            all_quota_details.append(r)
-            if 'paging' in r and 'next' in r['paging']:
-                next_page = r['paging']['next']
-            else:
-                next_page = ""
-        for quota_list in all_quota_details:
-            dir_quotas = quota_list["quotas"]
-
-
-        for dir_quota in dir_quotas:
-            usages = {}
-            usages["directory"] = dir_quota["path"]
-            usages["usage"] = int(dir_quota["capacity_usage"])
-            usages["limit"] = int(dir_quota["limit"])
-            dir_capacity_usages.append(usages) 
-    
-    with open("./config/previous_dir_usages.json", "r") as previousUsages:
-        previous_dir_usages = json.load(previousUsages)
-        
-        doc = dominate.document(title='Qumulo Storage Report')
-
-        with doc:
-            with table():
-                with tr():
-                    with th(style="text-align:left"):
-                        span("Directory")
-                    with th(style="text-align:center"):
-                        span("Capacity Change")
-                    with th(style="text-align:center"):
-                        span("Usage")
-                    with th(style="text-align:center"):
-                        span("Limit")
-                    with th(style="text-align:center"):
-                        span("Ratio")
-                for dir_capacity_usage in dir_capacity_usages:
-                    with tr():
-                        print(dir_capacity_usage)
-                        directory = dir_capacity_usage["directory"]
-                        usage= dir_capacity_usage["usage"]
-                        limit = dir_capacity_usage["limit"]
-                        ratio = round(usage / limit, 2)
-
-                        if directory in previous_dir_usages:
-                            data_change = round((dir_capacity_usage["usage"] - previous_dir_usages[directory]["usage"])/ 10 ** 9, 2)
-                            if data_change > 0:
-                                data_change = "+" + str(data_change) + " GB"
-                            elif data_change < 0:
-                                data_change = "-" + str(data_change) + " GB"
-                            elif data_change == 0:
-                                data_change = str(data_change) + " GB"
-                                                                
-                            previous_dir_usages[directory]["usage"] = dir_capacity_usage["usage"]
-
-                            
-                            with td(style="text-align:left"):
-                                span(directory)
-                            with td(style="text-align:center"):
-                                span(data_change)
-                            with td(style="text-align:center"):
-                                span(str(round(usage / 10 ** 9, 2))+ "GB") 
-                            with td(style="text-align:center"):
-                                span(str(round(limit / 10 ** 9, 2))+ "GB") 
-                            with td(style="text-align:center"):
-                                span(str(round(ratio))+ "%") 
-                
-                        else:
-                            usages = {}
-                            usages["usage"] = usage
-                            usages["directory"] = directory
-                            previous_dir_usages[directory] = usages
-                        
-                            with td(style="text-align:left"):
-                                span(directory)
-                            with td(style="text-align:center"):
-                                span("+"+str(round(usage / 10 ** 9, 2))+ "GB")
-                            with td(style="text-align:center"):
-                                span(str(round(usage / 10 ** 9, 2))+ "GB") 
-                            with td(style="text-align:center"):
-                                span(str(round(limit / 10 ** 9, 2))+ "GB") 
-                            with td(style="text-align:center"):
-                                span(str(round(ratio))+ "%")  
-                
-    with open("./config/previous_dir_usages.json", "w") as previousUsagesFile:
-        json.dump(previous_dir_usages, previousUsagesFile, indent=4)
-    
-    return doc
+PREVIOUS_USAGES_PATH = "./config/previous_dir_usages.json"
+HISTORY_DIR = "./config/history"
+OUTBOX_DIR = "./config/outbox"
+HISTORY_RETENTION = 400
 
-def main():    
-    args = ArgParsing.main()
+# The defaults of --max-workers, --summary-rows and --top
+MAX_CLUSTER_WORKERS = ArgParsing.MAX_CLUSTER_WORKERS
+SUMMARY_ROWS = ArgParsing.SUMMARY_ROWS
+TOP_ROWS = ArgParsing.TOP_ROWS
+
+# Trend columns of the report, as (title, age in seconds)
+TREND_PERIODS = [("Daily Change", DAY), ("Weekly Change", 7 * DAY), ("Monthly Change", 30 * DAY)]
+
+REPORT_COLUMNS = (["Directory", "Capacity Change"] + [title for title, _ in TREND_PERIODS] +
+                  ["Usage", "Limit", "Ratio"])
+
+# Column of the time-to-full estimates, added with --forecast
+ETA_COLUMN = "ETA to Full"
+
+# Estimates further out than this are not shown
+MAX_ETA_DAYS = 10 * 365
+
+# Column of the growth anomalies, added with --anomalies
+ANOMALY_COLUMN = "Anomaly"
+
+# Number of quotas in an anomaly alert
+ALERT_ROWS = 50
+
+# Columns of the roll-ups of the subtrees
+ROLLUP_COLUMNS = ["Subtree", "Quotas", "Capacity Change", "Usage", "Limit", "Ratio"]
+
+# format_gb - Format a GB value, e.g. "12.34GB"
+
+def format_gb(value):
+    return str(value) + "GB"
+
+# format_change - Format a capacity change in GB with an explicit sign
+
+def format_change(data_change):
+    if data_change > 0:
+        return "+" + str(data_change) + " GB"
+    return str(data_change) + " GB"
+
+# format_eta - Format the days until a quota is full
+
+def format_eta(days):
+    if days != days or days > MAX_ETA_DAYS:
+        return "-"
+    if days == 0:
+        return "Full"
+    if days < 1:
+        return "<1 day"
+    return f"{round(days)} days"
+
+# format_score - Mark an anomalous growth with its score
+
+def format_score(score, threshold):
+    if score > threshold:
+        return f"Spike ({score:.1f})"
+    return "-"
+
+# report_columns - The columns of the report tables
+
+def report_columns(args):
+    columns = list(REPORT_COLUMNS)
+    if getattr(args, "forecast", False):
+        columns.append(ETA_COLUMN)
+    if getattr(args, "anomalies", False):
+        columns.append(ANOMALY_COLUMN)
+    return columns
+
+# select_rows - Which quotas of a batch go into the report, and their selection keys
+#
+# The "top-growth" mode orders the quotas by their change since the last run,
+# "top-ratio" by how full they are. The "threshold" mode selects only the quotas
+# that are fuller than --ratio-above percent or grew by more than --growth-above
+# GB, will be full within --full-within days, or grew abnormally, largest growth
+# first. Returns (boolean mask, keys) as NumPy arrays.
+
+def select_rows(args, changes, ratios, etas=None, scores=None):
+    import numpy as np
+
+    report_mode = getattr(args, "report_mode", "all")
+    keys = ratios if report_mode == "top-ratio" else changes
+    selected = np.ones(len(changes), dtype=bool)
+    if report_mode == "threshold":
+        selected[:] = False
+        if args.ratio_above is not None:
+            selected |= ratios > args.ratio_above
+        if args.growth_above is not None:
+            selected |= changes > args.growth_above
+        if etas is not None and getattr(args, "full_within", None) is not None:
+            selected |= etas <= args.full_within
+        if scores is not None:
+            selected |= scores > args.anomaly_threshold
+    return selected, keys
+
+# write_rollups - The table of the roll-ups of the subtrees at the given depths
+
+def write_rollups(trie, depths, writer_class=ReportWriter):
+    from utils.QuotaBatch import GB
+
+    trie.rollup()
+    table = ReportTable(ROLLUP_COLUMNS, writer_class)
+    for subtree, _, count, usage, limit, change in trie.at_depths(depths):
+        ratio = round(usage * 100 / limit) if limit > 0 else 0
+        table.row([subtree, str(count), format_change(round(change / GB, 2)),
+                   format_gb(round(usage / GB, 2)), format_gb(round(limit / GB, 2)), f"{ratio}%"])
+    return table.finish()[0]
+
+def check_capacity(args, rc, history_dir=HISTORY_DIR, history=None, route_table=None):
+    # NumPy, the quota sources and the analysis stages are imported on the first
+    # collection rather than at startup
+    import numpy as np
+    from utils.Anomaly import growth_scores
+    from utils.Forecast import growth_rates, days_to_full
+    from utils.QuotaSource import QuotaSource, PrefetchingQuotaSource, AdaptivePageSizer
+    from utils.UsageSeries import UsageSeries
+
+    # Quotas are streamed page by page straight into the report below
+    page_size = getattr(args, "page_size", QuotaSource.DEFAULT_PAGE_SIZE)
+    page_sizer = None
+    if getattr(args, "adaptive_page_size", False):
+        page_sizer = AdaptivePageSizer(page_size, target_seconds=args.target_page_seconds)
+
+    if getattr(args, "engine", "sync") == "async":
+        from utils.AsyncQuotaSource import AsyncQuotaSource, AsyncRestClient
+        client = AsyncRestClient.from_rest_client(rc, concurrency=args.concurrency)
+        quota_source = AsyncQuotaSource(client, page_size=page_size, page_sizer=page_sizer,
+                                        prefetch_depth=max(1, args.prefetch_depth), logger=logger)
+    elif getattr(args, "prefetch_depth", 0):
+        quota_source = PrefetchingQuotaSource(rc, page_size=page_size, page_sizer=page_sizer,
+                                              prefetch_depth=args.prefetch_depth, logger=logger)
+    else:
+        quota_source = QuotaSource(rc, page_size=page_size, page_sizer=page_sizer, logger=logger)
+
+    # The usages of the last run and of the trend periods are read once up front.
+    # A history store handed in by the caller (the daemon) stays open afterwards.
+    own_history = history is None
+    if own_history:
+        history = open_history(history_dir, backend=getattr(args, "history_backend", "files"), logger=logger)
+    if history_dir == HISTORY_DIR:
+        history.import_previous_usages(PREVIOUS_USAGES_PATH)
+    now = time.time()
+    trend_usages = history.usages_ago([age for _, age in TREND_PERIODS], now=now)
+    previous_dir_usages = history.latest()
+
+    # The growth rates and anomaly scores are computed from the recent samples of
+    # the usage series plus the usages of this run. The anomalies with the highest
+    # scores are kept for the alert.
+    forecast = getattr(args, "forecast", False)
+    anomalies = getattr(args, "anomalies", False)
+    series = None
+    if forecast or anomalies:
+        series = UsageSeries(history_dir, logger=logger).load(history)
+    alert = TopRows(ALERT_ROWS) if anomalies and getattr(args, "anomaly_alert", False) else None
+    current_dir_usages = {}
+
+    # The table goes to a temporary file, in the format of the attachment if the
+    # report is attached. Apart from the "all" mode, only the top rows are kept
+    # while the quotas stream by. The summary of an attached report keeps the rows
+    # with the largest changes.
+    attach = getattr(args, "attach", None)
+    report_mode = getattr(args, "report_mode", "all")
+
+    def new_table(out=None):
+        return ReportTable(report_columns(args), REPORT_WRITERS[attach] if attach else ReportWriter,
+                           top=None if report_mode == "all" else getattr(args, "top", TOP_ROWS),
+                           summary_rows=getattr(args, "summary_rows", SUMMARY_ROWS) if attach else None,
+                           out=out)
+
+    table = new_table()
+
+    # The rows of every directory are also routed to the tables of its owners
+    owner_reports = OwnerReports(route_table, new_table) if route_table else None
+
+    # A selected row is only formatted if it makes it into the top rows
+    lazy = table.top is not None and owner_reports is None
+
+    # Every quota goes into the trie of the roll-ups, whichever rows are reported
+    rollup_depths = getattr(args, "rollup_depths", None)
+    trie = PathTrie() if rollup_depths else None
+
+    # Every page is diffed as a whole with column operations; only the
+    # formatting of the cells is done row by row
+    metrics = Metrics.current()
+    for batch in quota_source.batches():
+        started = time.perf_counter()
+        current_dir_usages.update(batch.snapshot())
+
+        # A directory that is new since the last run grew by its whole usage
+        changes = batch.changes(previous_dir_usages)[0]
+        if trie is not None:
+            trie.add_batch(batch, changes)
+        data_changes = batch.gb(changes)
+        trend_changes = []
+        for _, age in TREND_PERIODS:
+            changes, present = batch.changes(trend_usages[age])
+            trend_changes.append((batch.gb(changes).tolist(), present.tolist()))
+        usages = batch.gb(batch.usages).tolist()
+        limits = batch.gb(batch.limits).tolist()
+        ratios = batch.ratios()
+        etas = scores = None
+        if series is not None:
+            timestamps, samples = series.samples(batch.paths)
+        if forecast:
+            rates = growth_rates(np.append(timestamps, now), np.column_stack([samples, batch.usages]),
+                                 now, window=args.forecast_window * DAY)
+            etas = days_to_full(batch.usages, batch.limits, rates)
+        if anomalies:
+            scores = growth_scores(timestamps, samples, now, batch.usages)
+        selected, keys = select_rows(args, data_changes, ratios, etas, scores)
+        if etas is not None:
+            etas = etas.tolist()
+        if scores is not None:
+            scores = scores.tolist()
+        data_changes = data_changes.tolist()
+        keys = keys.tolist()
+        ratios = np.round(ratios).astype(np.int64).tolist()
+
+        def format_row(index):
+            trends = [format_change(changes[index]) if present[index] else "-"
+                      for changes, present in trend_changes]
+            cells = ([batch.paths[index], format_change(data_changes[index])] + trends +
+                     [format_gb(usages[index]), format_gb(limits[index]), str(ratios[index]) + "%"])
+            if etas is not None:
+                cells.append(format_eta(etas[index]))
+            if scores is not None:
+                cells.append(format_score(scores[index], args.anomaly_threshold))
+            return cells
+
+        metrics.record("diff", time.perf_counter() - started, rows=len(batch.paths))
+
+        # Formatting the cells and writing the rows is timed as rendering
+        started = time.perf_counter()
+        selected = np.flatnonzero(selected).tolist()
+        for index in selected:
+            cells = functools.partial(format_row, index) if lazy else format_row(index)
+            growth = abs(data_changes[index])
+            table.row(cells, keys[index], growth)
+            if owner_reports is not None:
+                owner_reports.row(batch.paths[index], cells, keys[index], growth)
+            if alert is not None and scores[index] > args.anomaly_threshold:
+                alert.add(scores[index], cells)
+        metrics.record("render_rows", time.perf_counter() - started, rows=len(selected))
+
+    with metrics.span("render_rows"):
+        report_file, summary = table.finish()
+        owner_files = owner_reports.files() if owner_reports is not None else {}
+        rollup_file = write_rollups(trie, rollup_depths, type(table.writer)) if trie is not None else None
+
+    with metrics.span("history_write", rows=len(current_dir_usages)):
+        history.append(current_dir_usages, ts=now)
+        retention = history_retention(args)
+        if retention:
+            history.prune(retention * DAY, now=now)
+        if series is not None:
+            series.append(current_dir_usages, now)
+            series.save()
+    if own_history:
+        history.close()
+    else:
+        history.release()
     
-    if args.config_file:
-        # Get the configuration file so that we can figure out how often to run the program
-        config = ConfigFileParser(args.config_file, logger)
-        
-        # Validate the config
+    return report_file, owner_files, summary, rollup_file, alert
+
+# history_retention - Days of history to keep, 0 for all of it
+#
+# The SQLite store is meant for multi-year trend queries, so unless told
+# otherwise it keeps everything; the other stores keep HISTORY_RETENTION days.
+
+def history_retention(args):
+    retention = getattr(args, "history_retention", None)
+    if retention is not None:
+        return retention
+    return 0 if getattr(args, "history_backend", "files") == "sqlite" else HISTORY_RETENTION
+
+# cluster_history_dir - Every cluster of a multi-cluster run keeps its own history
+
+def cluster_history_dir(cluster_config):
+    return path.join(HISTORY_DIR, cluster_config['address'])
+
+# The report tables of one cluster: the full table, the tables of the owners as
+# {recipient: (table file, summary)}, for an attached report the TopRows of its
+# summary, the table of the roll-ups, and the TopRows of the anomaly alert (each
+# None when it is not wanted).
+ClusterResult = namedtuple("ClusterResult", ["cluster", "report_file", "owner_files", "summary", "rollup_file",
+                                             "alert"])
+
+# collect_cluster - Login to a single cluster (or reuse the session's client) and write its report tables
+#
+# A client the daemon kept from an earlier run may hold a token that has expired
+# since. On a 401 the session logs in again and the cluster is collected once more.
+
+def collect_cluster(session, cluster_config, history_dir):
+    for attempt in range(2):
+        cluster, pool = session.client(cluster_config)
         try:
-            config.validate()
-            configs = config.get_configs()
-                
-            try:
-                if args.cluster:
-                    rc = Authentication.login_with_args(args)
-                else:
-                    rc = Authentication.login_with_configs(configs)
-            except:
-                sys.exit(1)
-                
-            try:
-                cluster = rc.cluster.get_cluster_conf()["cluster_name"]
-                email_from = configs['email']['from']
-                email_to = configs['email']['to']
-                email_login = configs['email']['login']
-                email_password = configs['email']['password']
-                email_server = configs['email']['server']
-                email_port = configs['email']['port']
-                email_use = configs['email']['use']
-            except:
-                sys.exit(1)
-            
+            return ClusterResult(cluster, *check_capacity(session.args, pool, history_dir,
+                                                          session.history(history_dir), session.route_table))
         except Exception as err:
-            logger.error(f'Configuration would not validate, error is {err}')
-            sys.exit(1)
-            
-    else:
+            expired = getattr(err, "status_code", None) == 401
+            session.forget_client(cluster_config, expired=expired)
+            if not expired or attempt:
+                raise
+            logger.info(f"{cluster_config['address']}: the session expired, logging in again")
+        finally:
+            stats = pool.stats()
+            logger.info(f"{cluster_config['address']}: {stats['opened']} connections opened, "
+                        f"{stats['reused']} reused")
+
+# collect_clusters - Collect all clusters in parallel with a bounded thread pool
+#
+# clusters is a list of (cluster entry of the configuration, history directory).
+# Returns the ClusterResults and the addresses of the clusters that failed.
+
+def collect_clusters(session, clusters):
+    results = []
+    failed = []
+    args = session.args
+    workers = max(1, min(len(clusters), getattr(args, "max_workers", MAX_CLUSTER_WORKERS)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Cluster") as executor:
+        futures = {
+            executor.submit(collect_cluster, session, cluster_config, history_dir): cluster_config['address']
+            for cluster_config, history_dir in clusters
+        }
+        for future in as_completed(futures):
+            address = futures[future]
+            try:
+                results.append(future.result())
+                logger.info(f"Collected the quotas of {address}")
+            except Exception as err:
+                logger.error(f"Could not collect the quotas of {address}, error is {err}")
+                failed.append(address)
+
+    # Keep the report order stable regardless of which cluster finished first
+    results.sort(key=lambda result: result.cluster)
+    return results, sorted(failed)
+
+# build_report - Put the tables of one or more clusters into a single document
+#
+# results is a list of (cluster name, list of table files).
+
+def build_report(results, headings=None, failed=()):
+    message = io.StringIO()
+    write_report(ReportWriter(message), results, headings, failed)
+    return message.getvalue()
+
+# write_report - Write the document of build_report with any of the report writers
+
+def write_report(report, results, headings=None, failed=()):
+    if headings is None:
+        headings = len(results) > 1
+    report.begin_document('Qumulo Storage Report')
+    write_failed(report, failed)
+    for cluster, table_files in results:
+        if headings:
+            report.heading(cluster)
+        for table_file in table_files:
+            with table_file:
+                shutil.copyfileobj(table_file, report.out)
+    report.end_document()
+
+# write_failed - Name the clusters that could not be collected, so a partial report
+# is not taken for a complete one
+
+def write_failed(report, failed):
+    if failed:
+        report.paragraph(f'Could not collect {", ".join(failed)}; their directories are missing from this report.')
+
+# build_attachment - The full report as a gzip compressed file in the given format
+#
+# The document is compressed while it is written, so only the compressed bytes
+# are held in memory. Returns (file name, bytes).
+
+def build_attachment(results, attach, headings=None, name=progname):
+    file_name = f'{name}-{time.strftime("%Y%m%d")}.{attach}'
+    compressed = io.BytesIO()
+    with gzip.GzipFile(filename=file_name, mode="wb", fileobj=compressed) as gzipFile:
+        with io.TextIOWrapper(gzipFile, encoding="utf-8", newline="") as out:
+            write_report(REPORT_WRITERS[attach](out), results, headings)
+    return file_name + ".gz", compressed.getvalue()
+
+# compose_report - The message body and attachments of a report
+#
+# results is a list of (cluster name, list of table files, summary) and rollups a
+# list of (cluster name, list of roll-up table files). The tables are sent inline,
+# the roll-ups of every cluster first, or as gzip compressed attachments in the
+# "attach" format with a summary in the body. The roll-ups have columns of their
+# own, so they are attached as a separate file. The clusters in "failed" are named
+# at the top of the body.
+
+def compose_report(results, attach=None, headings=None, columns=REPORT_COLUMNS, failed=(), rollups=()):
+    rollup_files = dict(rollups)
+    if not attach:
+        tables = [(cluster, rollup_files.get(cluster, []) + table_files) for cluster, table_files, _ in results]
+        return build_report(tables, headings, failed), None
+
+    attachments = [build_attachment([(cluster, table_files) for cluster, table_files, _ in results],
+                                    attach, headings)]
+    if rollups:
+        attachments.append(build_attachment(rollups, attach, headings, name=f'{progname}-Rollups'))
+    for file_name, data in attachments:
+        logger.debug(f"Attached {file_name}, {len(data)} bytes")
+    message = build_summary([(cluster, summary) for cluster, _, summary in results],
+                            [file_name for file_name, _ in attachments], columns, failed)
+    return message, attachments
+
+# build_summary - The message body of an attached report: the largest changes of every cluster
+#
+# results is a list of (cluster name, TopRows) and file_names the names of the
+# attachments, the full report first.
+
+def build_summary(results, file_names, columns=REPORT_COLUMNS, failed=()):
+    message = io.StringIO()
+    report = ReportWriter(message)
+    report.begin_document('Qumulo Storage Report')
+    write_failed(report, failed)
+    for cluster, summary in results:
+        report.heading(cluster)
+        report.paragraph(f'{len(summary.rows())} largest capacity changes of {summary.row_count} directories')
+        report.begin_table(columns)
+        for cells in summary.rows():
+            report.row(cells)
+        report.end_table()
+    report.paragraph(f'The full report is attached as {file_names[0]}.')
+    if len(file_names) > 1:
+        report.paragraph(f'The roll-ups are attached as {file_names[1]}.')
+    report.end_document()
+    return message.getvalue()
+
+# build_alert - The message body of an anomaly alert
+#
+# results is a list of (cluster name, TopRows of the anomalous quotas).
+
+def build_alert(results, columns=REPORT_COLUMNS):
+    message = io.StringIO()
+    report = ReportWriter(message)
+    report.begin_document('Qumulo Quota Growth Alert')
+    for cluster, alert in results:
+        report.heading(cluster)
+        report.paragraph(f'{alert.row_count} directories grew much faster than they used to')
+        report.begin_table(columns)
+        for cells in alert.rows():
+            report.row(cells)
+        report.end_table()
+    report.end_document()
+    return message.getvalue()
+
+#
+# Session Class
+#
+# Everything a run needs that is worth keeping between runs of the daemon: the
+# validated configuration (reloaded only when the file changes), the logged in
+# RestClients with their cluster names, and the open history stores. Bearer tokens
+# and cluster names are also kept in the on-disk SessionCache for the next process.
+
+
+class Session(object):
+    def __init__(self, args):
+        self.args = args
+        self.configs = None
+        self.__clients = {}
+        self.__histories = {}
+        self.__lock = threading.Lock()
+        self.session_cache = None if args.no_session_cache else Authentication.SessionCache()
+        self.route_table = None
+        self.outbox = None
+        if args.outbox or args.drain_outbox:
+            from utils.Outbox import Outbox
+            self.outbox = Outbox(OUTBOX_DIR, logger=logger)
+
+    # load_config - Load the configuration, applying it again only if the file changed since the last load
+
+    def load_config(self):
+        if not self.args.config_file:
+            return
+        config = ConfigFileParser(self.args.config_file, logger)
+        config.validate()
+        if config.get_configs() is self.configs:
+            return
+
+        reloaded = self.configs is not None
+        self.configs = config.get_configs()
+        self.route_table = RouteTable(self.configs.get('routes', []))
+        if reloaded:
+            logger.info(f"Reloaded {self.args.config_file}")
+
+        # The clusters or their credentials may have changed
+        for _, pool in self.__clients.values():
+            pool.close()
+        self.__clients = {}
+
+    # client - The (cluster name, ConnectionPool) of a cluster, logging in only when needed
+
+    def client(self, cluster_config):
+        address = cluster_config['address']
+        with self.__lock:
+            if address in self.__clients:
+                return self.__clients[address]
+        metrics = Metrics.current()
+        with metrics.span("login"):
+            rc = Authentication.login_with_cluster(cluster_config, self.session_cache)
+        with metrics.span("cluster_conf"):
+            cluster = Authentication.get_cluster_name(rc, cluster_config, self.session_cache)
+        pool = ConnectionPool(rc, size=self.args.pool_size, logger=logger)
+        with self.__lock:
+            self.__clients[address] = (cluster, pool)
+        return cluster, pool
+
+    # forget_client - Drop a client after a failure, and its cached token if it expired
+
+    def forget_client(self, cluster_config, expired=False):
+        with self.__lock:
+            client = self.__clients.pop(cluster_config['address'], None)
+        if client is not None:
+            client[1].close()
+        if expired and self.session_cache is not None:
+            self.session_cache.drop(cluster_config, "bearer_token")
+
+    # history - The history store of a directory, kept open for the next runs of the daemon
+
+    def history(self, history_dir):
+        if not self.args.daemon:
+            return None
+        with self.__lock:
+            if history_dir not in self.__histories:
+                self.__histories[history_dir] = open_history(history_dir, backend=self.args.history_backend,
+                                                             logger=logger)
+            return self.__histories[history_dir]
+
+    # email_settings - (from, to, login, password, server, port, use) of the report email
+
+    def email_settings(self):
+        if self.configs is not None:
+            email = self.configs['email']
+            return (email['from'], email['to'], email['login'], email['password'],
+                    email['server'], email['port'], email['use'])
+        email = self.args.email
+        return (email.email_from, email.email_to, email.login, email.password,
+                email.server, email.port, email.use)
+
+    # collect - Collect the report tables of all clusters of this run, see collect_clusters
+
+    def collect(self):
+        args = self.args
         if args.cluster:
-            rc = Authentication.login_with_args(args)
+            clusters = [(Authentication.cluster_from_args(args), HISTORY_DIR)]
+        elif isinstance(self.configs['cluster'], list):
+            clusters = [(cluster_config, cluster_history_dir(cluster_config))
+                        for cluster_config in self.configs['cluster']]
         else:
-            logger.error(f"No cluster was defined.")
-            sys.exit(1)
-            
+            clusters = [(self.configs['cluster'], HISTORY_DIR)]
+        return collect_clusters(self, clusters)
+
+    # run - Run one report, timing its phases into a run-metrics file with --metrics-dir
+
+    def run(self):
+        metrics_dir = self.args.metrics_dir
+        if not metrics_dir:
+            return self.report()
+
+        metrics = Metrics.begin_run()
         try:
-            cluster = rc.cluster.get_cluster_conf()["cluster_name"]
-            if args.email:
-                email_from = args.email.email_from
-                email_to = args.email.email_to
-                email_login = args.email.login
-                email_password = args.email.password
-                email_server = args.email.server
-                email_port = args.email.port
-                email_use = args.email.use
-        except:
-            sys.exit(1)
+            with metrics.span("run"):
+                self.report()
+        finally:
+            Metrics.end_run()
+            metrics_path = metrics.write(metrics_dir)
+            logger.metrics(metrics.phases())
+            logger.info(f"Wrote the run metrics to {metrics_path}")
+
+    # report - Collect all clusters, send the full report and the reports of the owners
+
+    def report(self):
+        self.load_config()
+        results, failed = self.collect()
+        if not results:
+            raise RuntimeError("None of the clusters could be collected.")
+
+        self.send_alert(results)
+
+        message, attachments = self.compose(
+            [(result.cluster, [result.report_file], result.summary) for result in results], failed=failed,
+            rollups=[(result.cluster, [result.rollup_file]) for result in results if result.rollup_file])
+        email_from, email_to = self.email_settings()[:2]
+
+        # Build a subject line
+        if len(results) > 1:
+            subject = f'Latest directory trend report for {len(results)} clusters'
+        else:
+            subject = f'Latest directory trend report for "{results[0].cluster}"'
+        if failed:
+            subject += f' ({len(failed)} of {len(results) + len(failed)} clusters missing)'
+
+        if self.outbox is not None:
+            self.spool_reports(results, subject, message, attachments)
+            return
 
-    capacity_changes = check_capacity(args, rc)
+        with self.email_session() as email:
+            email.send(email_from, email_to, subject, message, attachments)
 
-    email = Email(logger= logger)
+        self.send_owner_reports(results, subject)
 
-    # Build a subject and message line
-    subject = f'Latest directory trend report for "{cluster}"'
-    message = capacity_changes
+    # send_alert - Send the anomalies found by this run ahead of the report, if there are any
+
+    def send_alert(self, results):
+        alerts = [(result.cluster, result.alert) for result in results if result.alert and result.alert.row_count]
+        if not alerts:
+            return
+
+        email_from, email_to = self.email_settings()[:2]
+        count = sum(alert.row_count for _, alert in alerts)
+        subject = f'Quota growth alert: {count} directories on {", ".join(cluster for cluster, _ in alerts)}'
+        message = build_alert(alerts, report_columns(self.args))
+        logger.warning(f"{count} directories grew abnormally, sending an alert")
+
+        if self.outbox is not None:
+            from utils.Email import Email
+            self.outbox.put(email_from, email_to,
+                            Email(logger=logger).build_message(email_from, email_to, subject, message).as_string())
+            return
+        with self.email_session() as email:
+            email.send(email_from, email_to, subject, message)
+
+    # compose - The message body and attachments of a report, see compose_report
+
+    def compose(self, results, headings=None, failed=(), rollups=()):
+        with Metrics.current().span("render") as span:
+            message, attachments = compose_report(results, self.args.attach, headings, report_columns(self.args),
+                                                  failed, rollups)
+            span.add(bytes=len(message) + sum(len(data) for _, data in attachments or []))
+        return message, attachments
+
+    # email_session - A new EmailSession with the configured SMTP settings
+
+    def email_session(self):
+        from utils.Email import EmailSession
+        (_, _, email_login, email_password,
+         email_server, email_port, email_use) = self.email_settings()
+        return EmailSession(email_server, email_port, email_login, email_password, email_use,
+                            logger=logger)
+
+    # owner_reports - The clusters and tables of every owner, keyed by recipient
+
+    @staticmethod
+    def owner_reports(results):
+        owners = {}
+        for result in results:
+            for recipient, (owner_file, summary) in result.owner_files.items():
+                owners.setdefault(recipient, []).append((result.cluster, [owner_file], summary))
+        return owners
+
+    # spool_reports - Put the full report and the owner reports in the outbox
+    #
+    # In daemon mode the drainer thread delivers them, otherwise one delivery pass
+    # is made right away and whatever fails is retried by the next run or by
+    # --drain-outbox.
+
+    def spool_reports(self, results, subject, message, attachments=None):
+        email_from, email_to = self.email_settings()[:2]
+        from utils.Email import Email
+        composer = Email(logger=logger)
+        self.outbox.put(email_from, email_to,
+                        composer.build_message(email_from, email_to, subject, message, attachments).as_string())
+
+        owners = self.owner_reports(results)
+        for recipient in sorted(owners):
+            owner_message, owner_attachments = self.compose(owners[recipient], headings=len(results) > 1)
+            self.outbox.put(email_from, recipient,
+                            composer.build_message(email_from, recipient, subject, owner_message,
+                                                   owner_attachments).as_string())
+        logger.info(f"Spooled {1 + len(owners)} messages to {self.outbox.spool_dir}")
+
+        if not self.args.daemon:
+            self.drain_outbox()
+
+    # drain_outbox - One delivery pass over the outbox
+
+    def drain_outbox(self):
+        with self.email_session() as email:
+            return self.outbox.drain(email)
+
+    # send_owner_reports - Send every owner the tables of their directories
+    #
+    # The messages are spread over a bounded pool of workers, each of which sends
+    # its share on a single SMTP session. A recipient whose message fails is logged
+    # and the worker goes on with the next one.
+
+    def send_owner_reports(self, results, subject):
+        owners = self.owner_reports(results)
+        if not owners:
+            return
+
+        email_from = self.email_settings()[0]
+
+        def send_share(recipients):
+            sent = 0
+            with self.email_session() as email:
+                for recipient in recipients:
+                    try:
+                        message, attachments = self.compose(owners[recipient], headings=len(results) > 1)
+                        email.send(email_from, recipient, subject, message, attachments)
+                        sent += 1
+                    except Exception as err:
+                        logger.error(f"Could not send the owner report to {recipient}, error is {err}")
+            return sent
+
+        recipients = sorted(owners)
+        workers = max(1, min(len(recipients), self.args.mail_workers))
+        shares = [recipients[index::workers] for index in range(workers)]
+        sent = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Mail") as executor:
+            for share, future in zip(shares, [executor.submit(send_share, share) for share in shares]):
+                try:
+                    sent += future.result()
+                except Exception as err:
+                    logger.error(f"Could not send the owner reports to {', '.join(share)}, error is {err}")
+        if sent < len(recipients):
+            logger.warning(f"Sent owner reports to {sent} of {len(recipients)} recipients")
+        else:
+            logger.info(f"Sent owner reports to {sent} recipients")
+
+    def close(self):
+        for _, pool in self.__clients.values():
+            pool.close()
+        self.__clients = {}
+        for history in self.__histories.values():
+            history.close()
+        self.__histories = {}
+
+
+# schedule_from_args - The schedule of the daemon mode
+#
+# The first run time is computed right away, so that a cron expression that never
+# matches is rejected at startup instead of stopping the daemon.
+
+def schedule_from_args(args):
+    if args.schedule:
+        schedule = CronSchedule(args.schedule)
+    else:
+        schedule = IntervalSchedule(args.interval)
+    schedule.next_run(time.time())
+    return schedule
+
+def main():    
+    args = ArgParsing.main()
+
+    if not args.config_file and not args.cluster:
+        logger.error("No cluster was defined.")
+        sys.exit(1)
+    if not args.config_file and not args.email:
+        logger.error("No email was defined.")
+        sys.exit(1)
+
+    session = Session(args)
+    try:
+        session.load_config()
+    except Exception as err:
+        logger.error(f'Configuration would not validate, error is {err}')
+        sys.exit(1)
+
+    if args.drain_outbox:
+        try:
+            session.drain_outbox()
+        except Exception as err:
+            logger.error(f'Could not drain {OUTBOX_DIR}, error is {err}')
+            sys.exit(1)
+        remaining = len(session.outbox.pending())
+        if remaining:
+            logger.warning(f'{remaining} messages are still waiting in {OUTBOX_DIR}')
+        return
+
+    if args.daemon:
+        if session.outbox is not None:
+            session.outbox.start_drainer(session.email_session)
+        try:
+            schedule = schedule_from_args(args)
+        except ValueError as err:
+            logger.error(f'Invalid schedule, error is {err}')
+            sys.exit(1)
+        try:
+            run_forever(schedule, session.run, logger=logger)
+        finally:
+            session.close()
+        return
 
-    email.send_mail(email_from, email_to, subject, message,
-                    email_server, email_port, email_login,
-                    email_password, email_use)
+    try:
+        session.run()
+    except Exception as err:
+        logger.error(f'{err}')
+        sys.exit(1)
 
         
 if __name__ == "__main__":
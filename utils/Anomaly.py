@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Anomaly.py
+#
+# Detection of quotas that grow much faster than they used to
+
+# Import Python system libraries
+import numpy as np
+
+from utils.History import DAY
+from utils.QuotaBatch import GB
+
+# Fewest earlier growth rates a quota needs before it is scored
+MIN_SAMPLES = 3
+
+# Scales the median absolute deviation to the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+# Growth scores above this mark a quota as anomalous
+DEFAULT_THRESHOLD = 5.0
+
+
+# growth_scores - How abnormal the growth of every quota since its last sample is
+#
+# timestamps and usages are a UsageSeries window (one row per quota, NaN for a
+# missing sample) and "current" the usages of this run. The daily growth rates
+# between consecutive samples give every quota a baseline, the median of its
+# rates, and a spread, their median absolute deviation. The score is the distance
+# of the growth since the last sample from the baseline, in spreads; the spread is
+# at least min_spread bytes per day, so that a quota that never changed is not
+# flagged for a few bytes. Quotas with fewer than MIN_SAMPLES earlier rates get
+# NaN. Everything is computed for all rows at once.
+
+def growth_scores(timestamps, usages, now, current, min_spread=GB):
+    samples = usages.shape[1]
+    scores = np.full(usages.shape[0], np.nan)
+    if samples < 2:
+        return scores
+
+    rates = np.diff(usages, axis=1) / (np.diff(timestamps) / DAY)
+
+    # The growth since the last sample of every row
+    present = ~np.isnan(usages)
+    last = samples - 1 - np.argmax(present[:, ::-1], axis=1)
+    rows = np.arange(usages.shape[0])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        current_rates = ((np.asarray(current, dtype=np.float64) - usages[rows, last]) /
+                         ((now - timestamps[last]) / DAY))
+
+    counts = (~np.isnan(rates)).sum(axis=1)
+    scored = (counts >= MIN_SAMPLES) & present.any(axis=1) & (now > timestamps[last])
+    if not scored.any():
+        return scores
+
+    rates = rates[scored]
+    counts = counts[scored]
+    baselines = row_medians(rates, counts)
+    spreads = MAD_SCALE * row_medians(np.abs(rates - baselines[:, None]), counts)
+    scores[scored] = (current_rates[scored] - baselines) / np.maximum(spreads, min_spread)
+    return scores
+
+
+# row_medians - The median of every row, ignoring NaN, given the count of the others
+#
+# Sorting moves the NaN to the end of every row, so the median is read at the
+# middle of the first "counts" values; this is a lot faster than np.nanmedian.
+
+def row_medians(values, counts):
+    values = np.sort(values, axis=1)
+    lower = np.take_along_axis(values, ((counts - 1) // 2)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(values, (counts // 2)[:, None], axis=1)[:, 0]
+    return (lower + upper) / 2
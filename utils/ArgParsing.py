@@ -36,6 +36,15 @@ progname = "Quota Reporting"
 progdesc = "Qumulo Directory Quota Reporting"
 progvers = "7.3.0"
 
+# Maximum number of clusters collected in parallel
+MAX_CLUSTER_WORKERS = 8
+
+# Number of rows in the summary of a report that is sent as an attachment
+SUMMARY_ROWS = 20
+
+# Number of rows of the report in the top-N and threshold report modes
+TOP_ROWS = 100
+
 # Start by getting any command line arguments
 def parse_args(parser, commands):
     # Divide argv by commands
@@ -58,6 +67,17 @@ def parse_args(parser, commands):
     return args
 
 
+# depth_list - Parse a comma separated list of depths, e.g. "1,2"
+def depth_list(value):
+    try:
+        depths = [int(depth) for depth in value.split(",") if depth.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'"{value}" is not a comma separated list of depths')
+    if not depths or min(depths) < 0:
+        raise argparse.ArgumentTypeError(f'"{value}" is not a comma separated list of depths')
+    return depths
+
+
 def main():
     try:
         parser = argparse.ArgumentParser()
@@ -84,6 +104,219 @@ def main():
             default = "",
             help="The configuration file which has the definitions of how to run this script"
         )
+        parser.add_argument(
+            "--startup-profile",
+            dest="startup_profile",
+            action="store_true",
+            help="Print how long every module took to import when the program exits"
+        )
+        parser.add_argument(
+            "--metrics-dir",
+            dest="metrics_dir",
+            default="",
+            help="Write the timing of every phase of a run to run-<timestamp>.json in this directory, e.g. ./config/metrics"
+        )
+        parser.add_argument(
+            "--no-session-cache",
+            dest="no_session_cache",
+            action="store_true",
+            help="Always log in again instead of reusing the cached session tokens and cluster names"
+        )
+        parser.add_argument(
+            "--mail-workers",
+            dest="mail_workers",
+            type=int,
+            default=4,
+            help="Number of SMTP sessions used in parallel to send the owner reports"
+        )
+        parser.add_argument(
+            "--report-mode",
+            dest="report_mode",
+            default="all",
+            choices=["all", "top-growth", "top-ratio", "threshold"],
+            help="Report every quota, the --top quotas that grew the most or are the fullest, or the quotas above --ratio-above or --growth-above"
+        )
+        parser.add_argument(
+            "--top",
+            dest="top",
+            type=int,
+            default=TOP_ROWS,
+            help="Maximum number of quotas in the report in the top-growth, top-ratio and threshold modes"
+        )
+        parser.add_argument(
+            "--ratio-above",
+            dest="ratio_above",
+            type=float,
+            default=90.0,
+            help="Percentage of the limit above which a quota is reported in the threshold mode"
+        )
+        parser.add_argument(
+            "--growth-above",
+            dest="growth_above",
+            type=float,
+            default=None,
+            help="Growth in GB since the last run above which a quota is reported in the threshold mode"
+        )
+        parser.add_argument(
+            "--forecast",
+            dest="forecast",
+            action="store_true",
+            help="Add an \"ETA to Full\" column, estimated from the growth of every quota over --forecast-window days"
+        )
+        parser.add_argument(
+            "--forecast-window",
+            dest="forecast_window",
+            type=float,
+            default=30,
+            help="Days of usage history the growth rates are fitted to"
+        )
+        parser.add_argument(
+            "--full-within",
+            dest="full_within",
+            type=float,
+            default=None,
+            help="Also report the quotas that will be full within this many days in the threshold mode (needs --forecast)"
+        )
+        parser.add_argument(
+            "--anomalies",
+            dest="anomalies",
+            action="store_true",
+            help="Add an \"Anomaly\" column marking the quotas that grew much faster than the median of their own history"
+        )
+        parser.add_argument(
+            "--anomaly-threshold",
+            dest="anomaly_threshold",
+            type=float,
+            default=5.0,
+            help="Growth score (distance from the median growth, in scaled median absolute deviations) above which a quota is an anomaly"
+        )
+        parser.add_argument(
+            "--anomaly-alert",
+            dest="anomaly_alert",
+            action="store_true",
+            help="Send a separate alert email listing the anomalies before the report (needs --anomalies)"
+        )
+        parser.add_argument(
+            "--rollup-depths",
+            dest="rollup_depths",
+            type=depth_list,
+            default=None,
+            help='Comma separated depths of the subtrees whose quotas are rolled up in a table of their own, e.g. "1,2" for "/projects/" and "/projects/x/"'
+        )
+        parser.add_argument(
+            "--attach",
+            dest="attach",
+            default=None,
+            choices=["csv", "html"],
+            help="Attach the full report as a gzip compressed CSV or HTML file and send only a summary of the largest changes in the message body"
+        )
+        parser.add_argument(
+            "--summary-rows",
+            dest="summary_rows",
+            type=int,
+            default=SUMMARY_ROWS,
+            help="Number of directories in the summary of an attached report"
+        )
+        parser.add_argument(
+            "--outbox",
+            dest="outbox",
+            action="store_true",
+            help="Spool the messages in ./config/outbox and deliver them with retries instead of sending them inline"
+        )
+        parser.add_argument(
+            "--drain-outbox",
+            dest="drain_outbox",
+            action="store_true",
+            help="Only deliver the messages waiting in the outbox, then exit"
+        )
+        parser.add_argument(
+            "--daemon",
+            dest="daemon",
+            action="store_true",
+            help="Keep running and send a report on every --interval or --schedule"
+        )
+        parser.add_argument(
+            "--interval",
+            dest="interval",
+            type=int,
+            default=86400,
+            help="Seconds between two reports in daemon mode"
+        )
+        parser.add_argument(
+            "--schedule",
+            dest="schedule",
+            default="",
+            help='Cron expression of the report times in daemon mode, e.g. "00 01 * * *" (overrides --interval)'
+        )
+        parser.add_argument(
+            "--history-backend",
+            dest="history_backend",
+            default="files",
+            choices=["files", "sqlite", "journal", "binary"],
+            help="Where the usage history is kept: one snapshot file per run, a SQLite database, a journal of changes, or memory-mapped binary snapshots"
+        )
+        parser.add_argument(
+            "--history-retention",
+            dest="history_retention",
+            type=int,
+            default=None,
+            help="Days of usage history to keep, 0 to keep everything (default: 400, everything with --history-backend sqlite)"
+        )
+        parser.add_argument(
+            "--max-workers",
+            dest="max_workers",
+            type=int,
+            default=MAX_CLUSTER_WORKERS,
+            help="Maximum number of clusters collected in parallel when the configuration file lists several"
+        )
+        parser.add_argument(
+            "--page-size",
+            dest="page_size",
+            type=int,
+            default=1000,
+            help="Number of quotas requested per page (the starting size with --adaptive-page-size)"
+        )
+        parser.add_argument(
+            "--adaptive-page-size",
+            dest="adaptive_page_size",
+            action="store_true",
+            help="Grow or shrink the quota page size toward --target-page-seconds"
+        )
+        parser.add_argument(
+            "--target-page-seconds",
+            dest="target_page_seconds",
+            type=float,
+            default=0.5,
+            help="Target latency of a single quota page request with --adaptive-page-size"
+        )
+        parser.add_argument(
+            "--engine",
+            dest="engine",
+            default="sync",
+            choices=["sync", "async"],
+            help="Collect the quotas with the qumulo RestClient (sync) or with the asyncio engine (async)"
+        )
+        parser.add_argument(
+            "--concurrency",
+            dest="concurrency",
+            type=int,
+            default=16,
+            help="Maximum number of directory lookups in flight per cluster with --engine async (the quota pages are always requested one at a time)"
+        )
+        parser.add_argument(
+            "--pool-size",
+            dest="pool_size",
+            type=int,
+            default=2,
+            help="Number of keep-alive connections kept open to every cluster"
+        )
+        parser.add_argument(
+            "--prefetch-depth",
+            dest="prefetch_depth",
+            type=int,
+            default=0,
+            help="Number of quota pages to fetch in the background while the previous one is processed (0 disables prefetching)"
+        )
 
 
 
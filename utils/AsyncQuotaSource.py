@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# AsyncQuotaSource.py
+#
+# asyncio engine to page through the quotas of a Qumulo cluster
+
+# Import Python system libraries
+import argparse
+import asyncio
+import json
+import ssl
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit, parse_qs
+
+from utils import Metrics
+from utils.Logger import Logger
+from utils.QuotaSource import QuotaSource, PrefetchingQuotaSource
+
+
+class AsyncRequestError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code} {message}')
+        self.status_code = status_code
+        self.message = message
+
+
+#
+# AsyncRestClient Class
+#
+# A small asyncio HTTP/1.1 client for the Qumulo REST API. It keeps up to
+# "max_connections" keep-alive connections and a semaphore bounds the number of
+# requests in flight, so thousands of requests can be queued from a single thread.
+# Like the qumulo client it does not verify the (usually self-signed) certificate.
+
+
+class AsyncRestClient(object):
+    DEFAULT_CONCURRENCY = 16
+    DEFAULT_TIMEOUT = 60
+
+    def __init__(self, host, port, bearer_token=None, use_ssl=True,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = int(port)
+        self.bearer_token = bearer_token
+        self.use_ssl = use_ssl
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+
+        # Created on first use, inside the event loop that uses them
+        self.__semaphore = None
+        self.__idle = []
+
+    # from_rest_client - Talk to the same cluster with the same credentials as a RestClient
+    #
+    # Also accepts a ConnectionPool, which wraps a RestClient.
+
+    @classmethod
+    def from_rest_client(cls, rc, **kwargs):
+        rc = getattr(rc, "rc", rc)
+        credentials = rc.conninfo.credentials
+        return cls(rc.conninfo.host, rc.conninfo.port,
+                   credentials.bearer_token if credentials is not None else None, **kwargs)
+
+    def ssl_context(self):
+        if not self.use_ssl:
+            return None
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    # request - Send a request and return the decoded JSON response
+
+    async def request(self, method, uri):
+        return (await self.request_with_size(method, uri))[0]
+
+    # request_with_size - Send a request and return (decoded JSON response, size of the body in bytes)
+
+    async def request_with_size(self, method, uri):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.__semaphore:
+            if self.__idle:
+                reader, writer = self.__idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, ssl=self.ssl_context()), self.timeout)
+            try:
+                status, reason, keep_alive, body = await asyncio.wait_for(
+                    self.__exchange(reader, writer, method, uri), self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.__idle.append((reader, writer))
+            else:
+                writer.close()
+
+        if status >= 400:
+            raise AsyncRequestError(status, reason)
+        return (json.loads(body) if body else None), len(body)
+
+    async def __exchange(self, reader, writer, method, uri):
+        lines = [f'{method} {uri} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                 'Accept: application/json', 'Connection: keep-alive', 'Content-Length: 0']
+        if self.bearer_token:
+            lines.append(f'Authorization: Bearer {self.bearer_token}')
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        status_line = (await reader.readline()).decode("latin-1").split(" ", 2)
+        if len(status_line) < 2:
+            raise ConnectionError(f'Connection to {self.host} closed')
+        status = int(status_line[1])
+        reason = status_line[2].strip() if len(status_line) > 2 else ""
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        return status, reason, keep_alive, body
+
+    # fetch_all - Send many GET requests at once, bounded by the semaphore
+
+    async def fetch_all(self, uris):
+        return await asyncio.gather(*(self.request("GET", uri) for uri in uris))
+
+    async def close(self):
+        while self.__idle:
+            _, writer = self.__idle.pop()
+            writer.close()
+        self.__semaphore = None
+
+
+#
+# AsyncQuotaSource Class
+#
+# The asyncio engine behind the QuotaSource interface. The quota pages are fetched
+# by a coroutine on an event loop of its own thread and handed over to the caller
+# through the bounded queue of PrefetchingQuotaSource, so check_capacity consumes
+# it exactly like the other sources. Every page holds the cursor of the next one,
+# so the pages are requested one at a time; only the per-directory lookups of
+# aggregates() go out concurrently.
+
+
+class AsyncQuotaSource(PrefetchingQuotaSource):
+    def __init__(self, client, page_size=QuotaSource.DEFAULT_PAGE_SIZE, page_sizer=None,
+                 prefetch_depth=PrefetchingQuotaSource.DEFAULT_PREFETCH_DEPTH, logger=None):
+        super().__init__(None, page_size=page_size, page_sizer=page_sizer,
+                         prefetch_depth=prefetch_depth, logger=logger)
+
+        # Store the AsyncRestClient used instead of a RestClient
+        self.client = client
+
+    # araw_pages - Async version of QuotaSource.raw_pages
+
+    async def araw_pages(self):
+        self.page_count = 0
+        self.fetch_seconds = 0.0
+        if self.page_sizer is not None:
+            self.page_size = self.page_sizer.page_size
+        next_page = self.first_page_uri()
+        while next_page:
+            start = time.monotonic()
+            page, size = await self.client.request_with_size("GET", next_page)
+            elapsed = time.monotonic() - start
+            self.fetch_seconds += elapsed
+            if not page:
+                break
+            self.page_count += 1
+            Metrics.current().record("page_fetch", elapsed, rows=len(page.get("quotas", [])), bytes=size)
+            if self.logger is not None:
+                self.logger.debug(f'Got quota page {self.page_count} from {next_page} in {elapsed:.3f}s')
+
+            next_page = page.get("paging", {}).get("next", "")
+            if next_page and self.page_sizer is not None:
+                self.resize(page, elapsed)
+                next_page = self.with_page_size(next_page, self.page_size)
+            yield page
+
+    # produce - Run the async pager on an event loop of the background thread
+
+    def produce(self, put):
+        async def pages():
+            try:
+                async for page in self.araw_pages():
+                    if not put(page):
+                        return
+            finally:
+                await self.client.close()
+
+        asyncio.run(pages())
+
+    # aggregates - Get the aggregates of many directories concurrently
+
+    def aggregates(self, paths):
+        async def fetch():
+            try:
+                uris = [f'/v1/files/{quote(path, safe="")}/aggregates/' for path in paths]
+                return await self.client.fetch_all(uris)
+            finally:
+                await self.client.close()
+
+        return dict(zip(paths, asyncio.run(fetch())))
+
+
+#
+# StandInServer Class
+#
+# A plain HTTP stand-in for the quota and aggregates APIs of a cluster, used by
+# main() below to exercise the engine without a cluster.
+
+
+class StandInServer(object):
+    def __init__(self, quota_count, delay=0.0):
+        self.quotas = [{"id": str(index), "path": f"/projects/p{index % 10}/d{index}/",
+                        "capacity_usage": str(index * 10 ** 6), "limit": str(10 ** 12)}
+                       for index in range(quota_count)]
+        self.delay = delay
+        self.port = None
+        self.connections = 0
+        self.__started = threading.Event()
+
+    def route(self, uri):
+        parts = urlsplit(uri)
+        if parts.path == QuotaSource.QUOTA_STATUS_URI:
+            query = parse_qs(parts.query)
+            limit = int(query.get("limit", ["1000"])[0])
+            after = int(query.get("after", ["0"])[0])
+            next_page = ""
+            if after + limit < len(self.quotas):
+                next_page = f'{QuotaSource.QUOTA_STATUS_URI}?after={after + limit}&limit={limit}'
+            return {"quotas": self.quotas[after:after + limit], "paging": {"next": next_page}}
+        return {"path": parts.path, "total_capacity": "0"}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            while (await reader.readline()).strip():
+                pass
+            await asyncio.sleep(self.delay)
+            body = json.dumps(self.route(request_line.decode().split(" ")[1])).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        writer.close()
+
+    def start(self):
+        def serve():
+            async def run():
+                server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+                self.port = server.sockets[0].getsockname()[1]
+                self.__started.set()
+                async with server:
+                    await server.serve_forever()
+            asyncio.run(run())
+
+        threading.Thread(target=serve, name="StandInServer", daemon=True).start()
+        self.__started.wait()
+        return self
+
+
+# Test Main Routine - This is not normally used as this class is usually imported
+
+def main():
+
+    # Define the name of the Program, Description, and Version.
+    progname = "Test-AsyncQuotaSource"
+    progdesc = "Testing the asyncio quota engine against a stand-in server."
+    progvers = "1.0"
+
+    logger = Logger("Test-AsyncQuotaSource")
+
+    # Get command line arguments
+    testargs = commandargs(progname, progvers, progdesc)
+
+    server = StandInServer(testargs.quotas, delay=testargs.delay).start()
+    client = AsyncRestClient("127.0.0.1", server.port, use_ssl=False, concurrency=testargs.concurrency)
+    source = AsyncQuotaSource(client, page_size=testargs.page_size, logger=logger)
+
+    start = time.monotonic()
+    paths = [quota.path for quota in source]
+    logger.info(f'Paged through {len(paths)} quotas in {source.page_count} pages '
+                f'in {time.monotonic() - start:.2f}s')
+    if len(paths) != testargs.quotas or len(set(paths)) != testargs.quotas:
+        logger.error('Failed! Not every quota was returned exactly once')
+        sys.exit(1)
+
+    start = time.monotonic()
+    aggregates = source.aggregates(paths[:testargs.lookups])
+    logger.info(f'Looked up {len(aggregates)} directories in {time.monotonic() - start:.2f}s '
+                f'over {server.connections} connections')
+    if len(aggregates) != min(testargs.lookups, len(paths)):
+        logger.error('Failed! Not every directory was looked up')
+        sys.exit(1)
+
+
+# Get command line arguments - primarily used for the size of the stand-in cluster
+
+def commandargs(progname, progvers, desc):
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "--version", action="version", version=f"{progname} - Version {progvers}"
+    )
+    parser.add_argument("--quotas", type=int, default=25000, help="Number of quotas of the stand-in server")
+    parser.add_argument("--page-size", type=int, default=1000, dest="page_size", help="Quotas per page")
+    parser.add_argument("--lookups", type=int, default=2000, help="Number of directory lookups")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--delay", type=float, default=0.01, help="Latency of the stand-in server in seconds")
+
+    try:
+        return parser.parse_args()
+    except argparse.ArgumentTypeError:
+        # Log an error
+        sys.exit(1)
+
+
+# Main Routine
+if __name__ == "__main__":
+    main()
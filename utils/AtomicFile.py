@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# AtomicFile.py
+#
+# Crash-safe replacement of the files the program keeps between runs
+
+# Import Python system libraries
+import contextlib
+import os
+import tempfile
+
+# The umask, read once, to give new files the same permissions open() would
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+# atomic_write - Write a file under a temporary name and rename it into place
+#
+# "with atomic_write(path) as file:" yields a temporary file of its own in the same
+# directory, so concurrent writers of the same path never share one. When the
+# block succeeds the file is flushed to disk and renamed over "path", so readers
+# see either the old or the new file, never part of one, even after a crash. When
+# it fails the temporary file is removed and "path" is left alone. The file gets
+# the given permissions (less the umask).
+
+@contextlib.contextmanager
+def atomic_write(file_path, mode="w", permissions=0o666):
+    directory, name = os.path.split(file_path)
+    fd, temp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        os.fchmod(fd, permissions & ~_UMASK)
+        with os.fdopen(fd, mode) as tempFile:
+            fd = None
+            yield tempFile
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
@@ -26,80 +26,181 @@
 #
 
 # Import Python system libraries
+import hashlib
+import json
+import os
 import sys
+import threading
+import time
 
 #  Import local Python libraries
-from utils.Logger import Logger
+from utils.AtomicFile import atomic_write
+from utils.Logger import LazyLogger
 
-logger = Logger()
+logger = LazyLogger()
 
-#  Qumulo Python libraries
-try:
-    import qumulo
+# Qumulo Python libraries, imported by load_qumulo() on the first login since
+# they take longer to import than everything else together. The clusters of a
+# multi-cluster run log in from several threads, so the imports are done under a
+# lock and the names are only published once all of them succeeded.
+qumulo = RestClient = Credentials = None
+qumulo_lock = threading.Lock()
+
+
+def import_qumulo():
+    import qumulo.lib.request
     from qumulo.rest_client import RestClient
     from qumulo.lib.auth import Credentials
-except ImportError as error:
-    logger.error(
-        "Unable to import the required Qumulo api bindings. Please run the following command: pip3 install qumulo_api"
-    )
-    sys.exit()
-
-
-
-
-def login_with_args(args):
-    #  Qumulo cluster login
-    if args.cluster:
-        if args.cluster.access_token:
-            try: 
-                rc = RestClient(
-                    args.cluster.address, cluster.port, Credentials(args.cluster.access_token)
-                )
-                logger.info(f"Connection established with {args.cluster.address}")
-            except:
-                logger.error(f'Login error')
-                sys.exit(1)
-        elif args.cluster.username and args.cluster.password:
-            try:
-                rc = RestClient(args.cluster.address, cluster.port)
-                rc.login(args.cluster.username, args.cluster.password)
-                logger.info(f"Connection established with {args.cluster.address}")
-            except qumulo.lib.request.RequestError as err:
-                logger.error(f'{err}')
-                sys.exit(1)
-            except:
-                logger.error(f'Connection issue with{args.cluster.address}')
-                sys.exit(1)
+    return qumulo, RestClient, Credentials
+
+
+def load_qumulo():
+    global qumulo, RestClient, Credentials
+    with qumulo_lock:
+        if RestClient is not None:
+            return
+        try:
+            modules = import_qumulo()
+        except ImportError:
+            logger.error(
+                "Unable to import the required Qumulo api bindings. Please run the following command: pip3 install qumulo_api"
+            )
+            sys.exit()
+        qumulo, RestClient, Credentials = modules
+
+
+# Where the session cache is kept and how long its entries are trusted
+SESSION_CACHE_PATH = "./config/.session_cache.json"
+SESSION_TTL = 8 * 60 * 60
+
+
+#
+# SessionCache Class
+#
+# An on-disk cache of the bearer token and the cluster name of every cluster that
+# was logged into, so that a run can skip the login and the get_cluster_conf round
+# trips. The file holds credentials, so it is only ever created readable and
+# writable by its owner, and it is rewritten atomically.
+
+
+class SessionCache(object):
+    def __init__(self, cache_path=SESSION_CACHE_PATH, ttl=SESSION_TTL):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__entries = None
+
+    # key - The cache key of a cluster entry of the configuration
+
+    @staticmethod
+    def key(cluster):
+        if cluster['access_token']:
+            user = "token:" + hashlib.sha256(cluster['access_token'].encode()).hexdigest()[:16]
         else:
-            logger.error(f"Connection issue with {configs['cluster']['address']}")
-            sys.exit(1)
-    return rc
+            user = cluster['username']
+        return f"{cluster['address']}:{cluster['port']}:{user}"
+
+    def __load(self):
+        if self.__entries is None:
+            self.__entries = {}
+            try:
+                with open(self.cache_path, "r") as cacheFile:
+                    self.__entries = json.load(cacheFile)
+            except (OSError, ValueError):
+                pass
+        return self.__entries
+
+    # __save - Write the cache back; it is only a shortcut, so a failure is logged and ignored
+
+    def __save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with atomic_write(self.cache_path, permissions=0o600) as cacheFile:
+                json.dump(self.__entries, cacheFile)
+        except OSError as err:
+            logger.warning(f"Unable to write the session cache {self.cache_path}: {err}")
+
+    # get - The value of a cached item, or None if it is missing or expired
+
+    def get(self, cluster, item):
+        with self.__lock:
+            entry = self.__load().get(self.key(cluster), {}).get(item)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        return entry["value"]
+
+    def put(self, cluster, item, value):
+        with self.__lock:
+            entries = self.__load()
+            entries.setdefault(self.key(cluster), {})[item] = {"value": value, "expires": time.time() + self.ttl}
+            self.__save()
+
+    def drop(self, cluster, item):
+        with self.__lock:
+            entries = self.__load()
+            if entries.get(self.key(cluster), {}).pop(item, None) is not None:
+                self.__save()
 
 
-def login_with_configs(configs):
-    # Qumulo cluster login
-    if configs['cluster']['address']:
-        if configs['cluster']['access_token']:
-            try: 
-                rc = RestClient(
-                    configs['cluster']['address'], configs['cluster']['port'], Credentials(configs['cluster']['access_token'])
-                )
-                logger.info(f"Connection established with {configs['cluster']['address']}")
-            except:
-                logger.error(f'Login error')
-                sys.exit(1)
-        elif configs['cluster']['username'] and configs['cluster']['password']:
+def login_with_cluster(cluster, cache=None):
+    # Qumulo cluster login for a single entry of the "cluster" list. Unlike the
+    # other login routines this raises instead of exiting, so that one failing
+    # cluster does not stop the collection of the others.
+    #
+    # With a SessionCache, a cached bearer token is checked with a cheap who-am-i
+    # request and reused; only if the cluster rejects it with a 401 do we log in.
+    load_qumulo()
+    if cache is not None and not cluster['access_token']:
+        bearer_token = cache.get(cluster, "bearer_token")
+        if bearer_token:
+            rc = RestClient(cluster['address'], cluster['port'], Credentials(bearer_token))
             try:
-                rc = RestClient(configs['cluster']['address'], configs['cluster']['port'])
-                rc.login(configs['cluster']['username'], configs['cluster']['password'])
-                logger.info(f"Connection established with {configs['cluster']['address']}")
+                rc.auth.who_am_i()
+                logger.info(f"Reusing the cached session of {cluster['address']}")
+                return rc
             except qumulo.lib.request.RequestError as err:
-                logger.error(f'{err}')
-                sys.exit(1)
-            except:
-                logger.error(f"Connection issue with {configs['cluster']['address']}")
-                sys.exit(1)
-        else:
-            logger.error(f"Connection issue with {configs['cluster']['address']}")
-            sys.exit(1)
+                if err.status_code != 401:
+                    raise
+                cache.drop(cluster, "bearer_token")
+
+    if cluster['access_token']:
+        rc = RestClient(cluster['address'], cluster['port'], Credentials(cluster['access_token']))
+    elif cluster['username'] and cluster['password']:
+        rc = RestClient(cluster['address'], cluster['port'])
+        try:
+            rc.login(cluster['username'], cluster['password'])
+        except qumulo.lib.request.RequestError as err:
+            logger.error(f"{err}")
+            raise
+        if cache is not None:
+            cache.put(cluster, "bearer_token", rc.credentials.bearer_token)
+    else:
+        logger.error(f"No credentials were defined for {cluster['address']}")
+        raise ValueError(f"No credentials were defined for {cluster['address']}")
+    logger.info(f"Connection established with {cluster['address']}")
     return rc
+
+
+# get_cluster_name - The name of the cluster, from the SessionCache when possible
+
+def get_cluster_name(rc, cluster, cache=None):
+    if cache is not None:
+        cluster_name = cache.get(cluster, "cluster_name")
+        if cluster_name:
+            return cluster_name
+    cluster_name = rc.cluster.get_cluster_conf()["cluster_name"]
+    if cache is not None:
+        cache.put(cluster, "cluster_name", cluster_name)
+    return cluster_name
+
+
+# cluster_from_args - The "cluster" subcommand as a cluster entry of the configuration
+
+def cluster_from_args(args):
+    return {
+        'address': args.cluster.address,
+        'port': args.cluster.cluster_port,
+        'username': args.cluster.username,
+        'password': args.cluster.password,
+        'access_token': args.cluster.access_token,
+    }
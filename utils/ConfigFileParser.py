@@ -28,12 +28,10 @@
 # Import Python system libraries
 import json
 import argparse
-import json
+import hashlib
 import os
 import sys
-
-import jsonschema
-from jsonschema import validate
+import threading
 
 
 from utils.Logger import Logger
@@ -45,9 +43,20 @@ from utils.Logger import Logger
 # This class deals with loading both a configuration and schema file and then
 # validating that the configuration file matches the schema. Once done, the configuration
 # file contents can be used by a calling program.
+#
+# The validator of a schema is built once per process and the validated
+# configurations are cached, keyed by the modification time and the SHA-256 of
+# the file, so validating an unchanged file again costs a stat() call. A file that
+# was touched but not changed is hashed, and its cached configuration is returned.
+# The cached configuration is shared between the callers and must not be modified.
 
 
 class ConfigFileParser(object):
+
+    # {schema path: (mtime, validator)} and {config path: (mtime, digest, schema mtime, config)}
+    __validators = {}
+    __configs = {}
+    __lock = threading.Lock()
     def __init__(self, config_path, logger=None):
 
         # Store the config file
@@ -67,48 +76,79 @@ class ConfigFileParser(object):
         # file and end in .schema (versus .json for the config file)
 
         config_base = os.path.splitext(self.config_path)[0]
+        schema_path = f'{config_base}.schema.json'
 
         try:
-            with open(f'{config_base}.schema.json', "r") as schemaFile:
-                self.schema = json.load(schemaFile)
+            validator, schema_mtime = self.__validator(schema_path)
         except (Exception,) as err:
             if self.logger is not None:
                 self.logger.error(f'{config_base}.schema reported error of: {err}')
-                raise Exception(err)
+            raise Exception(err)
+        self.schema = validator.schema
 
-        # Get the configuration file...
+        # Get the configuration file, unless it is unchanged since it was validated
 
         try:
-            with open(self.config_path, "r") as configFile:
-                self.config = json.load(configFile)
+            mtime = os.stat(self.config_path).st_mtime_ns
+            with self.__lock:
+                cached = self.__configs.get(self.config_path)
+            if cached is not None and cached[0] == mtime and cached[2] == schema_mtime:
+                self.config = cached[3]
+                return
+
+            with open(self.config_path, "rb") as configFile:
+                content = configFile.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if cached is not None and cached[1] == digest and cached[2] == schema_mtime:
+                with self.__lock:
+                    self.__configs[self.config_path] = (mtime, digest, schema_mtime, cached[3])
+                self.config = cached[3]
+                return
+
+            config = json.loads(content)
         except Exception as err:
             if self.logger is not None:
                 self.logger.error(f'{self.config_path} reported error of {err}')
-                raise Exception(err)
+            raise Exception(err)
 
         # Now, validate the config file against the schema
 
-        is_valid, msg = self.__validate_json(configdata=self.config,
-                                             schemadata=self.schema)
+        import jsonschema
+        error = jsonschema.exceptions.best_match(validator.iter_errors(config))
 
         # If the configuration is not valid, print out the error message and exit
 
-        if is_valid is not True:
+        if error is not None:
             if self.logger is not None:
                 self.logger.error(f'{self.config_path} did not validate!')
-                self.logger.error(f'Error was: {msg}')
-                raise jsonschema.exceptions.ValidationError(msg)
-    
-    @staticmethod
-    def __validate_json(configdata, schemadata):
-
-        try:
-            validate(instance=configdata, schema=schemadata)
-        except jsonschema.exceptions.ValidationError as err:
-            return False, err
-
-        message = "Given JSON data is valid"
-        return True, message
+                self.logger.error(f'Error was: {error.message}')
+            raise error
+
+        self.config = config
+        with self.__lock:
+            self.__configs[self.config_path] = (mtime, digest, schema_mtime, config)
+
+    # __validator - The compiled validator of a schema file, built again only when the file changes
+
+    @classmethod
+    def __validator(cls, schema_path):
+        mtime = os.stat(schema_path).st_mtime_ns
+        with cls.__lock:
+            cached = cls.__validators.get(schema_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], mtime
+
+        # jsonschema is only imported once there is something to validate
+        import jsonschema
+
+        with open(schema_path, "r") as schemaFile:
+            schema = json.load(schemaFile)
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        validator = validator_class(schema)
+        with cls.__lock:
+            cls.__validators[schema_path] = (mtime, validator)
+        return validator, mtime
     
     def get(self, key):
         # Get some configuration value based upon a python Dict key
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# ConnectionPool.py
+#
+# Pool of keep-alive connections to a Qumulo cluster
+
+# Import Python system libraries
+import queue
+import threading
+
+
+#
+# ConnectionPool Class
+#
+# Wraps a logged in RestClient with a fixed number of clones. Every clone keeps its
+# own persistent HTTPS connection, and a request borrows whichever clone is free,
+# so a crawl of many pages (or several threads paging at once) reuses a handful of
+# TLS sessions instead of handshaking again. A connection is only dropped after a
+# failed request, as the qumulo client does.
+#
+# The pool has the same request() method as a RestClient, so it can be handed to
+# QuotaSource in place of one. The opened/reused counters show how many requests
+# had to open a new connection.
+
+
+class ConnectionPool(object):
+    DEFAULT_SIZE = 2
+
+    def __init__(self, rc, size=DEFAULT_SIZE, logger=None):
+
+        # Store the RestClient that the pool hands out clones of
+        self.rc = rc
+
+        # Store the logger..
+        self.logger = logger
+
+        self.size = max(1, int(size))
+        self.__idle = queue.LifoQueue()
+        self.__idle.put(rc)
+        for _ in range(self.size - 1):
+            self.__idle.put(rc.clone())
+
+        self.__lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    # request - Send a request on a free pooled connection
+
+    def request(self, method, uri, **kwargs):
+        client = self.__idle.get()
+        try:
+            with self.__lock:
+                if client.conninfo.is_connected():
+                    self.reused += 1
+                else:
+                    self.opened += 1
+            try:
+                return client.request(method, uri, **kwargs)
+            except Exception:
+                # The connection may be unusable after an error, open a new one next time
+                client.refresh_connection()
+                raise
+        finally:
+            self.__idle.put(client)
+
+    # stats - The connection counters, e.g. for the log
+
+    def stats(self):
+        with self.__lock:
+            return {"opened": self.opened, "reused": self.reused}
+
+    def close(self):
+        while not self.__idle.empty():
+            self.__idle.get_nowait().close()
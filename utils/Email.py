@@ -33,6 +33,7 @@ import os
 import smtplib
 import sys
 import base64
+import threading
 import hmac
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
@@ -41,6 +42,7 @@ from email.utils import formatdate
 from email.base64mime import body_encode as encode_base64
 from smtplib import SMTPAuthenticationError as SMTPAuthenticationError
 
+from utils import Metrics
 from utils.ConfigFileParser import ConfigFileParser
 from utils.Logger import Logger
 
@@ -109,7 +111,7 @@ class Email(object):
     # send_mail - Routine to send email report as an attachment to a given user
 
     def send_mail(self, send_from, send_to, subject, message, server="localhost",
-                  port=25, login=None, password=None, use_what=None):
+                  port=25, login=None, password=None, use_what=None, attachment=None):
 
         # Compose and send email with provided info and attachments
         #
@@ -119,19 +121,39 @@ class Email(object):
         # send_to - email to name
         # subject - String with a subject line
         # message - String with a message body
-        # attachment - path to a file to attach to the email
         # server - mail server host name
         # port - port number
         # username - username to login to SMTP server (if required)
         # password - password to login to SMTP server (if required)
         # use_what - Must be either `tls` or `ssl`
+        # attachment - path to a file to attach to the email
+
+        attachments = None
+        if attachment is not None:
+            with open(attachment, "rb") as attachmentFile:
+                attachments = [(os.path.basename(attachment), attachmentFile.read())]
+
+        msg = self.build_message(send_from, send_to, subject, message, attachments)
+        smtp = self.connect(server, port, login, password, use_what)
+
+        if self.logger is not None:
+            self.logger.debug("Sending email")
+
+        smtp.sendmail(send_from, self.recipients(send_to), msg.as_string())
+        smtp.quit()
+
+    # build_message - Build the MIME message of a report
+    #
+    # send_to may be a single address or a list of them. attachments is a list of
+    # (file name, bytes); a name ending in ".gz" is sent as application/gzip.
 
+    def build_message(self, send_from, send_to, subject, message, attachments=None):
         if self.logger is not None:
             self.logger.debug("Encoding From, To, Date, and Subject for email")
 
         msg = MIMEMultipart()
         msg["From"] = send_from
-        msg["To"] = send_to
+        msg["To"] = ", ".join(self.recipients(send_to))
         msg["Date"] = formatdate(localtime=True)
         msg["Subject"] = subject
 
@@ -139,7 +161,22 @@ class Email(object):
 
         msg.attach(MIMEText(f'{message}', "html"))
 
-        # Send the email
+        for file_name, data in attachments or []:
+            subtype = "gzip" if file_name.endswith(".gz") else "octet-stream"
+            part = MIMEApplication(data, subtype, Name=file_name)
+            part["Content-Disposition"] = f'attachment; filename="{file_name}"'
+            msg.attach(part)
+        return msg
+
+    @staticmethod
+    def recipients(send_to):
+        if isinstance(send_to, str):
+            return [send_to]
+        return list(send_to)
+
+    # connect - Open an SMTP connection and log in if a login is given
+
+    def connect(self, server="localhost", port=25, login=None, password=None, use_what=None):
 
         if self.logger is not None:
             self.logger.debug("Initializing SMTP server")
@@ -150,13 +187,15 @@ class Email(object):
             try:
                 smtp = Kade_SSL(server, port, timeout=30)
             except (Exception,) as excpt:
-                self.logger.error(f"Could not connect to email server, error was {excpt}")
+                if self.logger is not None:
+                    self.logger.error(f"Could not connect to email server, error was {excpt}")
                 raise
         else:
             try:
                 smtp = smtplib.SMTP(server, port, timeout=30)
             except (Exception,) as excpt:
-                self.logger.error(f"Could not connect to email server, error was {excpt}")
+                if self.logger is not None:
+                    self.logger.error(f"Could not connect to email server, error was {excpt}")
                 raise
 
             if use_what == "tls":
@@ -165,22 +204,91 @@ class Email(object):
         # It is possible that we are talking to an email relay. In some cases, those
         # are owned by organizations that only allow email from within the organization.
         # In that case, they may not require a login/password combination
-        self.logger.info(f"SMTP connection is established with {login}")
-        if login != "":
+        if self.logger is not None:
+            self.logger.info(f"SMTP connection is established with {login}")
+        if login:
             if self.logger is not None:
                 self.logger.debug("Logging into SMTP server")
 
             try:
                 smtp.login(login, password)
             except Exception as excpt:
-                self.logger.error(f"Error while logging into email. Error: {excpt}")
+                if self.logger is not None:
+                    self.logger.error(f"Error while logging into email. Error: {excpt}")
                 raise
 
-        if self.logger is not None:
-            self.logger.debug("Sending email")
+        return smtp
 
-        smtp.sendmail(send_from, send_to, msg.as_string())
-        smtp.quit()
+
+#
+# EmailSession Class
+#
+# Sends any number of messages over a single authenticated SMTP connection instead
+# of connecting, starting TLS and logging in for each of them. If the server drops
+# the connection in between, it is opened again and the message is sent once more.
+
+
+class EmailSession(Email):
+    def __init__(self, server="localhost", port=25, login=None, password=None, use_what=None, logger=None):
+        super().__init__(logger=logger)
+
+        # Store the SMTP server settings for (re)connecting
+        self.server = server
+        self.port = port
+        self.login = login
+        self.password = password
+        self.use_what = use_what
+
+        self.__smtp = None
+        self.__lock = threading.Lock()
+        self.connections = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # send - Send a single message on the shared connection
+
+    def send(self, send_from, send_to, subject, message, attachments=None):
+        msg = self.build_message(send_from, send_to, subject, message, attachments)
+        self.send_message(send_from, send_to, msg.as_string())
+
+    # send_message - Send an already encoded message, reconnecting once if the server went away
+
+    def send_message(self, send_from, send_to, msg_string):
+        with self.__lock, Metrics.current().span("smtp_send", bytes=len(msg_string)):
+            for attempt in (1, 2):
+                if self.__smtp is None:
+                    self.__smtp = self.connect(self.server, self.port, self.login, self.password, self.use_what)
+                    self.connections += 1
+                try:
+                    if self.logger is not None:
+                        self.logger.debug("Sending email")
+                    self.__smtp.sendmail(send_from, self.recipients(send_to), msg_string)
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self.__smtp = None
+                    if attempt == 2:
+                        raise
+                    if self.logger is not None:
+                        self.logger.info("SMTP server disconnected, reconnecting")
+
+    # send_batch - Send a list of (send_from, send_to, subject, message) on the shared connection
+
+    def send_batch(self, messages):
+        for send_from, send_to, subject, message in messages:
+            self.send(send_from, send_to, subject, message)
+
+    def close(self):
+        with self.__lock:
+            if self.__smtp is not None:
+                try:
+                    self.__smtp.quit()
+                except smtplib.SMTPException:
+                    pass
+                self.__smtp = None
 
 
 # Test Main Routine - This is not normally used as this class is usually imported
@@ -223,7 +331,7 @@ def main():
 
     # Create the default Email class
 
-    email = EmailReport(logger=logger)
+    email = Email(logger=logger)
 
     # Build a subject and message line
 
@@ -236,7 +344,7 @@ def main():
         message = f'{msg_body}'
 
     email.send_mail(email_from, email_to, subject, message, server, port, login, password,
-                    testargs.attachment, use_what)
+                    use_what, attachment=testargs.attachment)
 
 
 # Routine to get the email data from the config file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Forecast.py
+#
+# Growth rates and time-to-full estimates of all quotas at once
+
+# Import Python system libraries
+import numpy as np
+
+from utils.History import DAY
+
+# Fewest samples a growth rate is estimated from
+MIN_SAMPLES = 3
+
+
+# growth_rates - The growth of every quota in bytes per day
+#
+# timestamps holds the times of the columns of "usages", which has one row per
+# quota and NaN for a missing sample. A least-squares line is fitted through the
+# samples of the last "window" seconds of every row at once: the sums the slopes
+# are made of are a few matrix-vector products over the whole matrix. Rows with
+# fewer than MIN_SAMPLES samples, or all of them at the same time, get NaN.
+
+def growth_rates(timestamps, usages, now, window=30 * DAY):
+    in_window = timestamps >= now - window
+    days = (timestamps[in_window] - now) / DAY
+    days -= days.mean() if len(days) else 0.0
+    usages = usages[:, in_window]
+
+    present = ~np.isnan(usages)
+    weights = present.astype(np.float64)
+    values = np.where(present, usages, 0.0)
+
+    counts = weights.sum(axis=1)
+    sum_days = weights @ days
+    sum_days2 = weights @ (days * days)
+    sum_usages = values.sum(axis=1)
+    sum_products = values @ days
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spread = sum_days2 - sum_days * sum_days / counts
+        rates = (sum_products - sum_days * sum_usages / counts) / spread
+
+    rates[(counts < MIN_SAMPLES) | ~(spread > 1e-9)] = np.nan
+    return rates
+
+
+# days_to_full - Days until every quota reaches its limit at its growth rate
+#
+# 0 for a quota that is already full, NaN for one without a limit, that is not
+# growing, or whose growth rate is unknown.
+
+def days_to_full(usages, limits, rates):
+    usages = np.asarray(usages, dtype=np.float64)
+    limits = np.asarray(limits, dtype=np.float64)
+    days = np.full(len(usages), np.nan)
+
+    limited = limits > 0
+    full = limited & (usages >= limits)
+    growing = limited & ~full & (rates > 0)
+    days[growing] = (limits[growing] - usages[growing]) / rates[growing]
+    days[full] = 0.0
+    return days
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# History.py
+#
+# Append-only usage history of the directory quotas
+
+# Import Python system libraries
+import bisect
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from array import array
+from collections.abc import Mapping
+
+#  Import local Python libraries
+from utils.AtomicFile import atomic_write
+
+# Seconds in a day, used by the callers to express "n days ago"
+DAY = 24 * 60 * 60
+
+
+#
+# BaseHistoryStore Class
+#
+# The interface check_capacity uses to read and write the usage history. A store
+# holds one snapshot per run; a snapshot maps each quota path to a compact
+# [usage, limit] pair. Subclasses provide timestamps(), load(), append() and prune().
+
+
+class BaseHistoryStore(object):
+
+    # A snapshot taken up to this long after the requested time still counts, so
+    # that a run starting a few seconds later than yesterday's finds yesterday's
+    DEFAULT_TOLERANCE = 60 * 60
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, logger=None):
+
+        # Store the allowed distance between a requested time and its snapshot
+        self.tolerance = tolerance
+
+        # Store the logger..
+        self.logger = logger
+
+        # Snapshots already read during this run, keyed by timestamp
+        self._cache = {}
+        self._timestamps = None
+
+    # snapshot_before - Timestamp of the newest snapshot taken at or shortly after "ts"
+
+    def snapshot_before(self, ts, before=None):
+        timestamps = self.timestamps()
+        if before is not None:
+            timestamps = timestamps[:bisect.bisect_left(timestamps, before)]
+        index = bisect.bisect_right(timestamps, ts + self.tolerance)
+        if index == 0:
+            return None
+        return timestamps[index - 1]
+
+    # latest - The last snapshot of the store, or an empty dict if there is none
+
+    def latest(self):
+        timestamps = self.timestamps()
+        if not timestamps:
+            return {}
+        return self.load(timestamps[-1])
+
+    # usages_ago - Get the snapshots taken closest to each of the given ages (in seconds)
+    #
+    # Returns a dict of age to snapshot. Ages that the history does not reach back to
+    # map to an empty dict.
+
+    def usages_ago(self, ages, now=None):
+        if now is None:
+            now = time.time()
+        wanted = {age: self.snapshot_before(now - age, before=now) for age in ages}
+        # The latest snapshot is read along with them, since every caller diffs against it too
+        loaded = self.load_many([ts for ts in wanted.values() if ts is not None] + self.timestamps()[-1:])
+        return {age: loaded[ts] if ts is not None else {} for age, ts in wanted.items()}
+
+    # load_many - Read several snapshots at once, {ts: snapshot}
+
+    def load_many(self, timestamps):
+        return {ts: self.load(ts) for ts in timestamps}
+
+    # import_previous_usages - Seed an empty store from the old previous_dir_usages.json
+
+    def import_previous_usages(self, usages_path):
+        if self.timestamps() or not os.path.exists(usages_path):
+            return
+        with open(usages_path, "r") as previousUsages:
+            previous_dir_usages = json.load(previousUsages)
+        if previous_dir_usages:
+            quotas = {directory: [usages["usage"], usages.get("limit", 0)]
+                      for directory, usages in previous_dir_usages.items()}
+            self.append(quotas, ts=os.path.getmtime(usages_path))
+            if self.logger is not None:
+                self.logger.info(f'Imported {len(quotas)} previous usages from {usages_path}')
+
+    # release - Drop every cached snapshot but the latest, which the next run diffs against
+
+    def release(self):
+        latest = self.timestamps()[-1:]
+        for ts in [ts for ts in self._cache if ts not in latest]:
+            self.forget(ts)
+
+    # forget - Drop a cached snapshot
+
+    def forget(self, ts):
+        self._cache.pop(ts, None)
+
+    def close(self):
+        pass
+
+
+#
+# HistoryStore Class
+#
+# Every run appends one snapshot file named after its timestamp. Existing files are
+# never rewritten, so the history grows by exactly one file per run.
+#
+# To get the usages at some point in the past only the single snapshot closest to
+# that point is loaded, so asking for "1 day ago", "7 days ago" and "30 days ago"
+# costs three snapshot reads no matter how many samples the history holds.
+
+
+class HistoryStore(BaseHistoryStore):
+    SNAPSHOT_EXT = ".json"
+
+    def __init__(self, history_dir, tolerance=BaseHistoryStore.DEFAULT_TOLERANCE, logger=None):
+        super().__init__(tolerance=tolerance, logger=logger)
+
+        # Store the directory holding the snapshot files
+        self.history_dir = history_dir
+
+    # timestamps - Sorted timestamps of all snapshots in the store
+
+    def timestamps(self):
+        if self._timestamps is None:
+            timestamps = []
+            if os.path.isdir(self.history_dir):
+                for name in os.listdir(self.history_dir):
+                    stem, ext = os.path.splitext(name)
+                    if ext == self.SNAPSHOT_EXT and stem.isdigit():
+                        timestamps.append(int(stem))
+            self._timestamps = sorted(timestamps)
+        return self._timestamps
+
+    # snapshot_path - File name of the snapshot taken at the given timestamp
+
+    def snapshot_path(self, ts):
+        return os.path.join(self.history_dir, f'{int(ts)}{self.SNAPSHOT_EXT}')
+
+    # load - Read a single snapshot, {path: [usage, limit]}
+
+    def load(self, ts):
+        if ts not in self._cache:
+            with open(self.snapshot_path(ts), "r") as snapshotFile:
+                self._cache[ts] = json.load(snapshotFile)["quotas"]
+        return self._cache[ts]
+
+    # append - Add the snapshot of this run to the store
+    #
+    # quotas is a dict of {path: [usage, limit]}. The file is written under a
+    # temporary name and renamed into place so readers never see half a snapshot.
+
+    def append(self, quotas, ts=None):
+        if ts is None:
+            ts = time.time()
+        ts = int(ts)
+        os.makedirs(self.history_dir, exist_ok=True)
+
+        with atomic_write(self.snapshot_path(ts)) as snapshotFile:
+            json.dump({"ts": ts, "quotas": quotas}, snapshotFile, separators=(",", ":"))
+
+        self._cache[ts] = quotas
+        if self._timestamps is not None and ts not in self._timestamps:
+            bisect.insort(self._timestamps, ts)
+        if self.logger is not None:
+            self.logger.debug(f'Appended a snapshot of {len(quotas)} quotas to {self.history_dir}')
+
+    # prune - Remove the snapshots older than the given age (in seconds)
+
+    def prune(self, max_age, now=None):
+        if now is None:
+            now = time.time()
+        for ts in [ts for ts in self.timestamps() if ts < now - max_age]:
+            os.remove(self.snapshot_path(ts))
+            self._timestamps.remove(ts)
+            self.forget(ts)
+
+
+#
+# SQLiteHistoryStore Class
+#
+# Same interface as HistoryStore, backed by a single SQLite database. Usages are
+# indexed on (path, ts), so the history of a single quota can be queried without
+# reading any snapshot, and each run is inserted as one batched transaction.
+
+
+class SQLiteHistoryStore(BaseHistoryStore):
+    DATABASE_NAME = "history.sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS snapshots (ts INTEGER PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS usages ("
+        " ts INTEGER NOT NULL, path TEXT NOT NULL, usage INTEGER NOT NULL, quota_limit INTEGER NOT NULL,"
+        " PRIMARY KEY (ts, path)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS usages_path_ts ON usages (path, ts)",
+    )
+
+    def __init__(self, history_dir, tolerance=BaseHistoryStore.DEFAULT_TOLERANCE, logger=None):
+        super().__init__(tolerance=tolerance, logger=logger)
+
+        # Store the directory and open (or create) the database in it
+        self.history_dir = history_dir
+        os.makedirs(history_dir, exist_ok=True)
+        self.db_path = os.path.join(history_dir, self.DATABASE_NAME)
+        # The daemon may use the store from a different worker thread on every run
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+    # timestamps - Sorted timestamps of all snapshots in the store
+
+    def timestamps(self):
+        if self._timestamps is None:
+            rows = self.db.execute("SELECT ts FROM snapshots ORDER BY ts")
+            self._timestamps = [ts for (ts,) in rows]
+        return self._timestamps
+
+    # load - Read a single snapshot, {path: [usage, limit]}
+
+    def load(self, ts):
+        if ts not in self._cache:
+            rows = self.db.execute("SELECT path, usage, quota_limit FROM usages WHERE ts = ?", (ts,))
+            self._cache[ts] = {path: [usage, limit] for path, usage, limit in rows}
+        return self._cache[ts]
+
+    # usage_history - All samples of a single quota as [(ts, usage, limit)], oldest first
+
+    def usage_history(self, path, since=None):
+        rows = self.db.execute("SELECT ts, usage, quota_limit FROM usages WHERE path = ? AND ts >= ? ORDER BY ts",
+                               (path, int(since or 0)))
+        return rows.fetchall()
+
+    # append - Add the snapshot of this run to the store in a single transaction
+
+    def append(self, quotas, ts=None):
+        if ts is None:
+            ts = time.time()
+        ts = int(ts)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO snapshots (ts) VALUES (?)", (ts,))
+            self.db.executemany("INSERT OR REPLACE INTO usages (ts, path, usage, quota_limit) VALUES (?, ?, ?, ?)",
+                                ((ts, path, usage, limit) for path, (usage, limit) in quotas.items()))
+
+        self._cache[ts] = quotas
+        if self._timestamps is not None and ts not in self._timestamps:
+            bisect.insort(self._timestamps, ts)
+        if self.logger is not None:
+            self.logger.debug(f'Appended a snapshot of {len(quotas)} quotas to {self.db_path}')
+
+    # prune - Remove the snapshots older than the given age (in seconds)
+
+    def prune(self, max_age, now=None):
+        if now is None:
+            now = time.time()
+        oldest = now - max_age
+        with self.db:
+            self.db.execute("DELETE FROM usages WHERE ts < ?", (oldest,))
+            self.db.execute("DELETE FROM snapshots WHERE ts < ?", (oldest,))
+        self._timestamps = None
+        self._cache = {ts: quotas for ts, quotas in self._cache.items() if ts >= oldest}
+
+    def close(self):
+        self.db.close()
+
+
+#
+# JournalHistoryStore Class
+#
+# Same interface as HistoryStore, but a run only appends the quotas that changed
+# since the previous run to a journal, so the write cost scales with the number of
+# changes instead of the number of quotas. The journal sits on top of a base
+# snapshot; the usages at any time are the base plus the journal entries up to it.
+#
+# Entries older than the retention are folded into the base once COMPACT_ENTRIES of
+# them have piled up. Compaction writes both files under temporary names and
+# renames them into place, so a crash leaves either the old or the new pair.
+
+
+class JournalHistoryStore(BaseHistoryStore):
+    BASE_NAME = "base.json"
+    JOURNAL_NAME = "journal.jsonl"
+    COMPACT_ENTRIES = 64
+
+    def __init__(self, history_dir, tolerance=BaseHistoryStore.DEFAULT_TOLERANCE, logger=None):
+        super().__init__(tolerance=tolerance, logger=logger)
+
+        # Store the directory holding the base snapshot and the journal
+        self.history_dir = history_dir
+        self.base_path = os.path.join(history_dir, self.BASE_NAME)
+        self.journal_path = os.path.join(history_dir, self.JOURNAL_NAME)
+
+        # Base snapshot and journal entries, read on first use
+        self.__base_ts = None
+        self.__base = None
+        self.__entries = None
+
+    # read - Load the base snapshot and the journal entries
+    #
+    # A torn last line from an interrupted run is cut off the journal, so that the
+    # next entry starts on a line of its own.
+
+    def read(self):
+        if self.__entries is not None:
+            return
+        self.__base_ts, self.__base = None, {}
+        if os.path.exists(self.base_path):
+            with open(self.base_path, "r") as baseFile:
+                base = json.load(baseFile)
+            self.__base_ts, self.__base = base["ts"], base["quotas"]
+
+        self.__entries = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r+b") as journalFile:
+                complete = 0
+                for line in journalFile:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("no line end")
+                        self.__entries.append(json.loads(line))
+                    except ValueError:
+                        journalFile.truncate(complete)
+                        if self.logger is not None:
+                            self.logger.warning(f'Cut a torn entry off {self.journal_path} at byte {complete}')
+                        break
+                    complete += len(line)
+
+    # timestamps - Sorted timestamps of the base and all journal entries
+
+    def timestamps(self):
+        if self._timestamps is None:
+            self.read()
+            timestamps = [entry["ts"] for entry in self.__entries]
+            if self.__base_ts is not None:
+                timestamps.insert(0, self.__base_ts)
+            self._timestamps = timestamps
+        return self._timestamps
+
+    # load - Replay the journal on top of the base up to the given timestamp
+
+    def load(self, ts):
+        return self.load_many([ts])[ts]
+
+    # load_many - Replay the journal once for all the given timestamps
+
+    def load_many(self, timestamps):
+        wanted = sorted(set(ts for ts in timestamps if ts not in self._cache))
+        if wanted:
+            self.read()
+            quotas = dict(self.__base)
+            entries = iter(self.__entries)
+            entry = next(entries, None)
+            for ts in wanted:
+                while entry is not None and entry["ts"] <= ts:
+                    self.apply(quotas, entry)
+                    entry = next(entries, None)
+                self._cache[ts] = dict(quotas)
+        return {ts: self._cache[ts] for ts in timestamps}
+
+    @staticmethod
+    def apply(quotas, entry):
+        quotas.update(entry["changed"])
+        for path in entry["removed"]:
+            quotas.pop(path, None)
+
+    # append - Add only the changes since the last run to the journal
+
+    def append(self, quotas, ts=None):
+        if ts is None:
+            ts = time.time()
+        ts = int(ts)
+        os.makedirs(self.history_dir, exist_ok=True)
+
+        previous = self.latest()
+        changed = {path: usages for path, usages in quotas.items() if previous.get(path) != list(usages)}
+        removed = [path for path in previous if path not in quotas]
+
+        if self.timestamps():
+            entry = {"ts": ts, "changed": changed, "removed": removed}
+            try:
+                with open(self.journal_path, "a") as journalFile:
+                    journalFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    journalFile.flush()
+                    os.fsync(journalFile.fileno())
+            except BaseException:
+                # Read the journal again, cutting off whatever part of the entry was written
+                self.__entries = None
+                self._timestamps = None
+                raise
+            self.__entries.append(entry)
+        else:
+            # The very first run becomes the base snapshot
+            self.__base_ts, self.__base = ts, dict(quotas)
+            self.write_atomic(self.base_path, [{"ts": ts, "quotas": self.__base}])
+
+        self._cache[ts] = dict(quotas)
+        self._timestamps = None
+        if self.logger is not None:
+            self.logger.debug(f'Journaled {len(changed)} changed and {len(removed)} removed quotas '
+                              f'to {self.journal_path}')
+
+    # prune - Fold the entries older than the given age (in seconds) into the base
+    #
+    # The base and the journal are only rewritten once COMPACT_ENTRIES entries can
+    # be folded at once, so a store at its retention is compacted every
+    # COMPACT_ENTRIES runs instead of on every run.
+
+    def prune(self, max_age, now=None):
+        if now is None:
+            now = time.time()
+        self.read()
+        oldest = now - max_age
+        if sum(1 for entry in self.__entries if entry["ts"] < oldest) < self.COMPACT_ENTRIES:
+            return
+        self.compact(oldest)
+
+    # compact - Rewrite the base and the journal without the entries older than "oldest"
+
+    def compact(self, oldest):
+        self.read()
+        folded = [entry for entry in self.__entries if entry["ts"] < oldest]
+        if not folded:
+            return
+        for entry in folded:
+            self.apply(self.__base, entry)
+        self.__base_ts = folded[-1]["ts"]
+        self.__entries = self.__entries[len(folded):]
+
+        self.write_atomic(self.base_path, [{"ts": self.__base_ts, "quotas": self.__base}])
+        self.write_atomic(self.journal_path, self.__entries, lines=True)
+        self._timestamps = None
+        self._cache = {}
+        if self.logger is not None:
+            self.logger.info(f'Compacted {len(folded)} journal entries into {self.base_path}')
+
+    # write_atomic - Write JSON documents to a temporary file and rename it into place
+
+    @staticmethod
+    def write_atomic(file_path, documents, lines=False):
+        with atomic_write(file_path) as tempFile:
+            for document in documents:
+                tempFile.write(json.dumps(document, separators=(",", ":")))
+                if lines:
+                    tempFile.write("\n")
+
+
+#
+# BinarySnapshot Class
+#
+# A read-only, memory-mapped snapshot that behaves like the {path: [usage, limit]}
+# dict of the other stores without ever deserializing the whole file. Columns are
+# in native byte order and every section is 8-byte aligned:
+#
+#   header   magic, version, ts, count, slot count
+#   offsets  (count + 1) x uint64, start of every path in the path table
+#   usage    count x int64
+#   limit    count x int64
+#   slots    slot count x uint32, open addressing hash table of row + 1 (0 = empty)
+#   paths    the UTF-8 paths, sorted and stored once, back to back
+#
+# A lookup is a crc32 hash probe into the slots; only the probed paths are read.
+
+
+class BinarySnapshot(Mapping):
+    MAGIC = b"QSNP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIqQQ")
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.__file = open(file_path, "rb")
+        self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.ts, self.count, slot_count = self.HEADER.unpack_from(self.__mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError(f'{file_path} is not a version {self.VERSION} binary snapshot')
+        self.__mask = slot_count - 1
+
+        view = memoryview(self.__mm)
+        position = self.HEADER.size
+        self.__offsets = view[position:position + (self.count + 1) * 8].cast("Q")
+        position += (self.count + 1) * 8
+        self.__usages = view[position:position + self.count * 8].cast("q")
+        position += self.count * 8
+        self.__limits = view[position:position + self.count * 8].cast("q")
+        position += self.count * 8
+        self.__slots = view[position:position + slot_count * 4].cast("I")
+        self.__paths = position + slot_count * 4
+        view.release()
+
+    # path_bytes - The encoded path of a row, straight from the map
+
+    def path_bytes(self, row):
+        return self.__mm[self.__paths + self.__offsets[row]:self.__paths + self.__offsets[row + 1]]
+
+    # find - Row of a path, or -1 if the snapshot does not hold it
+
+    def find(self, path):
+        key = path.encode("utf-8")
+        slot = zlib.crc32(key) & self.__mask
+        while True:
+            row = self.__slots[slot] - 1
+            if row < 0:
+                return -1
+            if self.path_bytes(row) == key:
+                return row
+            slot = (slot + 1) & self.__mask
+
+    def __contains__(self, path):
+        return self.find(path) >= 0
+
+    def __getitem__(self, path):
+        row = self.find(path)
+        if row < 0:
+            raise KeyError(path)
+        return [self.__usages[row], self.__limits[row]]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self.path_bytes(row).decode("utf-8")
+
+    def close(self):
+        for name in ("_BinarySnapshot__offsets", "_BinarySnapshot__usages",
+                     "_BinarySnapshot__limits", "_BinarySnapshot__slots"):
+            if hasattr(self, name):
+                getattr(self, name).release()
+        self.__mm.close()
+        self.__file.close()
+
+    # write - Write {path: [usage, limit]} as a binary snapshot
+
+    @classmethod
+    def write(cls, file_path, quotas, ts):
+        rows = sorted((path.encode("utf-8"), usage, limit) for path, (usage, limit) in quotas.items())
+        count = len(rows)
+
+        slot_count = 8
+        while slot_count < count * 2:
+            slot_count *= 2
+        mask = slot_count - 1
+
+        offsets = array("Q", [0])
+        usages = array("q")
+        limits = array("q")
+        slots = array("I", bytes(4 * slot_count))
+        for row, (key, usage, limit) in enumerate(rows):
+            offsets.append(offsets[-1] + len(key))
+            usages.append(usage)
+            limits.append(limit)
+            slot = zlib.crc32(key) & mask
+            while slots[slot]:
+                slot = (slot + 1) & mask
+            slots[slot] = row + 1
+
+        with atomic_write(file_path, "wb") as snapshotFile:
+            snapshotFile.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, int(ts), count, slot_count))
+            for column in (offsets, usages, limits, slots):
+                snapshotFile.write(column.tobytes())
+            for key, _, _ in rows:
+                snapshotFile.write(key)
+
+
+#
+# BinaryHistoryStore Class
+#
+# Same layout as HistoryStore, one file per run, but every snapshot is a memory-mapped
+# BinarySnapshot. Looking up the previous usages of a quota neither parses a whole
+# snapshot nor holds one in memory, which keeps the resident size of a run small.
+
+
+class BinaryHistoryStore(HistoryStore):
+    SNAPSHOT_EXT = ".qsnap"
+
+    # load - Map a single snapshot
+
+    def load(self, ts):
+        if ts not in self._cache:
+            self._cache[ts] = BinarySnapshot(self.snapshot_path(ts))
+        return self._cache[ts]
+
+    # append - Add the snapshot of this run to the store
+
+    def append(self, quotas, ts=None):
+        if ts is None:
+            ts = time.time()
+        ts = int(ts)
+        os.makedirs(self.history_dir, exist_ok=True)
+
+        BinarySnapshot.write(self.snapshot_path(ts), quotas, ts)
+
+        if self._timestamps is not None and ts not in self._timestamps:
+            bisect.insort(self._timestamps, ts)
+        if self.logger is not None:
+            self.logger.debug(f'Appended a binary snapshot of {len(quotas)} quotas to {self.history_dir}')
+
+    # forget - Unmap a snapshot before it is dropped, so it does not keep its file open
+
+    def forget(self, ts):
+        snapshot = self._cache.pop(ts, None)
+        if snapshot is not None:
+            snapshot.close()
+
+    # prune - Unmap the snapshots before removing them
+
+    def prune(self, max_age, now=None):
+        if now is None:
+            now = time.time()
+        for ts in [ts for ts in self._cache if ts < now - max_age]:
+            self.forget(ts)
+        super().prune(max_age, now=now)
+
+    def close(self):
+        for snapshot in self._cache.values():
+            snapshot.close()
+        self._cache = {}
+
+
+# Available history backends, selected with --history-backend
+HISTORY_BACKENDS = {
+    "files": HistoryStore,
+    "sqlite": SQLiteHistoryStore,
+    "journal": JournalHistoryStore,
+    "binary": BinaryHistoryStore,
+}
+
+
+# open_history - Open the history store of the given backend
+
+def open_history(history_dir, backend="files", logger=None):
+    return HISTORY_BACKENDS[backend](history_dir, logger=logger)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# ImportProfiler.py
+#
+# Measures how long every module takes to import, for --startup-profile
+
+# Import Python system libraries
+import atexit
+import builtins
+import sys
+import threading
+import time
+from importlib.util import resolve_name
+
+
+#
+# ImportProfiler Class
+#
+# Wraps the built-in __import__ to time every import that loads a module which was
+# not loaded before, including the imports deferred to the code paths that need
+# them. The cumulative time of a module contains the modules it imports; its own
+# time does not. The profile is printed to stderr when the process exits, largest
+# cumulative time first. Imports of modules that are already loaded pass straight
+# through.
+
+
+class ImportProfiler(object):
+    REPORT_MODULES = 25
+
+    def __init__(self, out=None):
+        self.out = out
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.__import = builtins.__import__
+        self.__local = threading.local()
+
+    # start - Install a profiler and print its report at exit
+
+    @classmethod
+    def start(cls, out=None):
+        profiler = cls(out)
+        builtins.__import__ = profiler.profiled_import
+        atexit.register(profiler.report)
+        return profiler
+
+    def profiled_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self.__import(name, globals, locals, fromlist, level)
+        try:
+            module_name = resolve_name("." * level + name, globals.get("__package__")) if level else name
+        except (AttributeError, ImportError, ValueError):
+            module_name = name
+        if module_name in sys.modules:
+            return self.__import(name, globals, locals, fromlist, level)
+
+        stack = self.__local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self.__import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            own, cumulative = self.timings.get(module_name, (0.0, 0.0))
+            self.timings[module_name] = (own + elapsed - nested, cumulative + elapsed)
+
+    # report - Print the modules with the largest import times
+
+    def report(self):
+        out = self.out or sys.stderr
+        builtins.__import__ = self.__import
+        total = sum(own for own, _ in self.timings.values())
+        out.write(f"Startup profile: {len(self.timings)} modules imported in {total * 1000:.1f} ms, "
+                  f"{(time.perf_counter() - self.started) * 1000:.1f} ms since the profile started\n")
+        out.write(f"{'cumulative ms':>14} {'own ms':>9}  module\n")
+        ranked = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+        for module_name, (own, cumulative) in ranked[:self.REPORT_MODULES]:
+            out.write(f"{cumulative * 1000:14.1f} {own * 1000:9.1f}  {module_name}\n")
@@ -179,6 +179,18 @@ class Logger(object):
         '''
         self.logger.critical(msg)
 
+    def metrics(self, phases):
+        '''
+        Logs a summary of the phases of a run, longest total time first
+
+        :param phases: Dict of phase name to count, seconds, max_seconds and summed fields
+        '''
+        for name, phase in sorted(phases.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            fields = "".join(f", {field} {value}" for field, value in phase.items()
+                             if field not in ("count", "seconds", "max_seconds"))
+            self.logger.info(f"{name}: {phase['count']}x, {phase['seconds'] * 1000:.1f} ms total, "
+                             f"{phase['max_seconds'] * 1000:.1f} ms max{fields}")
+
     # GETTERS
 
     def __get_level(self, level):
@@ -200,6 +212,31 @@ class Logger(object):
 
         return logging_lvl
 
+# = LazyLogger Class
+
+
+class LazyLogger(object):
+    '''
+    Stands in for a Logger that is only created when it is first used, so that
+    importing a module does not configure logging as a side effect
+    '''
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Constructor
+
+        :param args: Arguments of the Logger to create
+        :param kwargs: Keyword arguments of the Logger to create
+        '''
+        self.__args = args
+        self.__kwargs = kwargs
+        self.__logger = None
+
+    def __getattr__(self, name):
+        if self.__logger is None:
+            self.__logger = Logger(*self.__args, **self.__kwargs)
+        return getattr(self.__logger, name)
+
 # = Filter Class
 
 
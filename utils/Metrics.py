@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Metrics.py
+#
+# Per-phase timing spans of a run and the run-metrics JSON file
+
+# Import Python system libraries
+import json
+import os
+import threading
+import time
+
+#  Import local Python libraries
+from utils.AtomicFile import atomic_write
+
+
+#
+# RunMetrics Class
+#
+# Collects the spans of a single run: a phase name, its duration and numeric
+# fields such as rows and bytes, from any thread. The code being measured asks
+# current() for the recorder, which is a NullMetrics that does nothing unless a
+# run was started with begin_run(), so spans cost next to nothing when the
+# metrics are off.
+
+
+class RunMetrics(object):
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self.__lock = threading.Lock()
+
+    # span - Time a block: "with metrics.span("render") as span: ... span.add(bytes=n)"
+
+    def span(self, name, **fields):
+        return Span(self, name, fields)
+
+    # record - Record a phase measured by the caller
+
+    def record(self, name, seconds, **fields):
+        span = {"name": name, "start": round(time.time() - seconds - self.started, 6),
+                "seconds": round(seconds, 6)}
+        span.update(fields)
+        with self.__lock:
+            self.spans.append(span)
+
+    # phases - Count, total and longest duration, and the summed numeric fields of every phase
+
+    def phases(self):
+        phases = {}
+        with self.__lock:
+            spans = list(self.spans)
+        for span in spans:
+            phase = phases.setdefault(span["name"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += span["seconds"]
+            phase["max_seconds"] = max(phase["max_seconds"], span["seconds"])
+            for field, value in span.items():
+                if field not in ("name", "start", "seconds") and isinstance(value, (int, float)):
+                    phase[field] = phase.get(field, 0) + value
+        return phases
+
+    # write - Write the metrics of the run to run-<timestamp>.json in a directory
+    #
+    # The file is written under a temporary name and renamed into place.
+
+    def write(self, metrics_dir):
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics_path = os.path.join(metrics_dir, f'run-{int(self.started)}.json')
+        with self.__lock:
+            spans = list(self.spans)
+        metrics = {
+            "started": self.started,
+            "seconds": round(time.time() - self.started, 6),
+            "phases": self.phases(),
+            "spans": spans,
+        }
+        with atomic_write(metrics_path) as metricsFile:
+            json.dump(metrics, metricsFile, indent=1)
+        return metrics_path
+
+
+#
+# Span Class
+#
+# A context manager that records the time spent in its block, with the fields
+# given to RunMetrics.span() and added with add(), when the block exits.
+
+
+class Span(object):
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.started, **self.fields)
+
+    def add(self, **fields):
+        for field, value in fields.items():
+            self.fields[field] = self.fields.get(field, 0) + value
+
+
+#
+# NullMetrics Class
+#
+# The recorder used while no run is measured; every span is the same no-op.
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def add(self, **fields):
+        pass
+
+
+class NullMetrics(object):
+    enabled = False
+    NULL_SPAN = NullSpan()
+
+    def span(self, name, **fields):
+        return self.NULL_SPAN
+
+    def record(self, name, seconds, **fields):
+        pass
+
+
+_current = NullMetrics()
+
+
+# current - The recorder of the run being measured, or a NullMetrics
+
+def current():
+    return _current
+
+
+# begin_run - Start measuring a run
+
+def begin_run():
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+# end_run - Stop measuring and return the RunMetrics of the run
+
+def end_run():
+    global _current
+    metrics, _current = _current, NullMetrics()
+    return metrics
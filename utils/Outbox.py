@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Outbox.py
+#
+# On-disk spool of report emails waiting to be delivered
+
+# Import Python system libraries
+import contextlib
+import fcntl
+import json
+import os
+import smtplib
+import threading
+import time
+import uuid
+
+#  Import local Python libraries
+from utils.AtomicFile import atomic_write
+
+
+#
+# Outbox Class
+#
+# Rendered messages are written to a spool directory, one JSON file each, and
+# delivered later by drain(). A message that cannot be delivered stays in the spool
+# and is retried with an exponential backoff; after MAX_ATTEMPTS it is moved to the
+# "failed" subdirectory. Files are written under a temporary name and renamed into
+# place, so neither a crash nor a drain ever sees half a message. A drain claims
+# every message with an exclusive flock before sending it, so two drains of the
+# same spool, in this process or another, never send a message twice; the lock
+# goes away with the process, so a crash leaves no stale claim behind.
+
+
+class Outbox(object):
+    MESSAGE_EXT = ".json"
+    MAX_ATTEMPTS = 10
+    BASE_BACKOFF = 60
+    MAX_BACKOFF = 60 * 60
+
+    def __init__(self, spool_dir, logger=None):
+
+        # Store the spool directory and create it if needed
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        # Store the logger..
+        self.logger = logger
+
+        self.__lock = threading.Lock()
+
+    # put - Spool an encoded message for delivery
+
+    def put(self, send_from, send_to, msg_string):
+        name = f'{time.time():.6f}-{uuid.uuid4().hex}{self.MESSAGE_EXT}'
+        self.write(os.path.join(self.spool_dir, name), {
+            "from": send_from,
+            "to": send_to,
+            "message": msg_string,
+            "attempts": 0,
+            "next_attempt": 0,
+        })
+        if self.logger is not None:
+            self.logger.debug(f'Spooled a message to {send_to} as {name}')
+
+    @staticmethod
+    def write(file_path, entry):
+        with atomic_write(file_path) as spoolFile:
+            json.dump(entry, spoolFile)
+
+    # pending - Names of the spooled messages, oldest first
+
+    def pending(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith(self.MESSAGE_EXT))
+
+    # drain - Deliver every message that is due with the given EmailSession
+    #
+    # Returns the number of messages delivered. A pass stops at the first message
+    # that fails, as the others would most likely fail the same way.
+
+    def drain(self, sender):
+        delivered = 0
+        with self.__lock:
+            now = time.time()
+            for name in self.pending():
+                file_path = os.path.join(self.spool_dir, name)
+                try:
+                    spoolFile = open(file_path, "r")
+                except OSError:
+                    continue
+                with spoolFile:
+                    entry = self.claim(spoolFile)
+                    if entry is None or entry["next_attempt"] > now:
+                        continue
+
+                    try:
+                        sender.send_message(entry["from"], entry["to"], entry["message"])
+                    except (OSError, smtplib.SMTPException) as err:
+                        self.retry_later(file_path, name, entry, err)
+                        break
+
+                    # A message that is already gone was delivered all the same
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(file_path)
+                    delivered += 1
+
+        if delivered and self.logger is not None:
+            self.logger.info(f'Delivered {delivered} spooled messages')
+        return delivered
+
+    # claim - Lock an open spool file and read its message
+    #
+    # Returns None if another drain holds the message, or has already delivered or
+    # rescheduled it (replacing or removing the file after this one opened it).
+
+    @staticmethod
+    def claim(spoolFile):
+        try:
+            fcntl.flock(spoolFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        if os.fstat(spoolFile.fileno()).st_nlink == 0:
+            return None
+        try:
+            return json.load(spoolFile)
+        except ValueError:
+            return None
+
+    # retry_later - Back off after a failed delivery, or give up after MAX_ATTEMPTS
+
+    def retry_later(self, file_path, name, entry, err):
+        entry["attempts"] += 1
+        if entry["attempts"] >= self.MAX_ATTEMPTS:
+            os.replace(file_path, os.path.join(self.failed_dir, name))
+            if self.logger is not None:
+                self.logger.error(f'Giving up on the message to {entry["to"]} after {entry["attempts"]} '
+                                  f'attempts, error is {err}. It was moved to {self.failed_dir}')
+            return
+
+        backoff = min(self.MAX_BACKOFF, self.BASE_BACKOFF * 2 ** (entry["attempts"] - 1))
+        entry["next_attempt"] = time.time() + backoff
+        self.write(file_path, entry)
+        if self.logger is not None:
+            self.logger.warning(f'Could not deliver the message to {entry["to"]}, error is {err}. '
+                                f'Retrying in {backoff} seconds')
+
+    # start_drainer - Drain the outbox on a daemon thread every "interval" seconds
+    #
+    # sender_factory returns a new EmailSession for every pass.
+
+    def start_drainer(self, sender_factory, interval=30):
+        def drainer():
+            while True:
+                try:
+                    if self.pending():
+                        with sender_factory() as sender:
+                            self.drain(sender)
+                except Exception as err:
+                    if self.logger is not None:
+                        self.logger.error(f'Draining {self.spool_dir} failed, error is {err}')
+                time.sleep(interval)
+
+        thread = threading.Thread(target=drainer, name="OutboxDrainer", daemon=True)
+        thread.start()
+        return thread
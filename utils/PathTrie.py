@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# PathTrie.py
+#
+# Roll-ups of quota usage, limit and growth over the directory tree
+
+
+#
+# PathTrie Class
+#
+# A trie over the components of the quota paths ("/projects/x/" is "projects",
+# then "x"), built once per run while the quota pages stream in. rollup() then
+# aggregates every subtree in a single post-order pass over the nodes, so the
+# roll-ups cost O(number of quotas) instead of scanning all quotas once per prefix.
+#
+# Quotas nest: the usage of a quota on "/projects/" already contains the usage of
+# "/projects/x/". A node with a quota of its own therefore rolls up to its own
+# usage, limit and change, and only a node without a quota sums up its children.
+
+
+class PathTrie(object):
+    # Slots of a node list
+    CHILDREN, QUOTA, COUNT, USAGE, LIMIT, CHANGE = range(6)
+
+    def __init__(self):
+        self.root = self.new_node()
+
+    @staticmethod
+    def new_node():
+        return [{}, None, 0, 0, 0, 0]
+
+    @staticmethod
+    def components(path):
+        return [component for component in path.split("/") if component]
+
+    # add - Add the usage, limit and change (in bytes) of a quota
+
+    def add(self, path, usage, limit, change):
+        node = self.root
+        for component in self.components(path):
+            children = node[self.CHILDREN]
+            child = children.get(component)
+            if child is None:
+                child = children[component] = self.new_node()
+            node = child
+        node[self.QUOTA] = (usage, limit, change)
+
+    # add_batch - Add every quota of a QuotaBatch with the changes computed for it
+
+    def add_batch(self, batch, changes):
+        for path, usage, limit, change in zip(batch.paths, batch.usages.tolist(),
+                                              batch.limits.tolist(), changes.tolist()):
+            self.add(path, usage, limit, change)
+
+    # rollup - Aggregate the quotas of every subtree
+
+    def rollup(self):
+        stack = [(self.root, False)]
+        while stack:
+            node, visited = stack.pop()
+            children = node[self.CHILDREN].values()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+                continue
+
+            node[self.COUNT] = sum(child[self.COUNT] for child in children)
+            if node[self.QUOTA] is not None:
+                node[self.COUNT] += 1
+                node[self.USAGE], node[self.LIMIT], node[self.CHANGE] = node[self.QUOTA]
+            else:
+                node[self.USAGE] = sum(child[self.USAGE] for child in children)
+                node[self.LIMIT] = sum(child[self.LIMIT] for child in children)
+                node[self.CHANGE] = sum(child[self.CHANGE] for child in children)
+
+    # at_depths - The roll-ups of the subtrees at the given depths ("/" is 0)
+    #
+    # Yields (path, depth, number of quotas, usage, limit, change) in path order,
+    # after rollup().
+
+    def at_depths(self, depths):
+        depths = set(depths)
+        deepest = max(depths)
+        stack = [("/", 0, self.root)]
+        while stack:
+            path, depth, node = stack.pop()
+            if node[self.COUNT] == 0:
+                continue
+            if depth in depths:
+                yield path, depth, node[self.COUNT], node[self.USAGE], node[self.LIMIT], node[self.CHANGE]
+            if depth < deepest:
+                stack.extend((f"{path}{component}/", depth + 1, child)
+                             for component, child in sorted(node[self.CHILDREN].items(), reverse=True))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# QuotaBatch.py
+#
+# Columnar representation of a page of directory quotas
+
+# Import Python system libraries
+import numpy as np
+
+GB = 10 ** 9
+
+
+#
+# QuotaBatch Class
+#
+# Holds a page of quotas as a list of paths plus int64 NumPy columns for usage and
+# limit, so the changes, ratios and GB values of a whole page are computed with a
+# few array operations instead of Python math on every quota.
+
+
+class QuotaBatch(object):
+
+    # Previous usage of a path that a snapshot does not hold
+    MISSING = -1
+
+    def __init__(self, paths, usages, limits):
+        self.paths = paths
+        self.usages = np.asarray(usages, dtype=np.int64)
+        self.limits = np.asarray(limits, dtype=np.int64)
+
+    # from_quotas - Build a batch from the "quotas" list of a quota status page
+
+    @classmethod
+    def from_quotas(cls, quotas):
+        count = len(quotas)
+        paths = [quota["path"] for quota in quotas]
+        usages = np.fromiter((int(quota["capacity_usage"]) for quota in quotas), dtype=np.int64, count=count)
+        limits = np.fromiter((int(quota["limit"]) for quota in quotas), dtype=np.int64, count=count)
+        return cls(paths, usages, limits)
+
+    def __len__(self):
+        return len(self.paths)
+
+    # previous - Usage column of a {path: [usage, limit]} snapshot aligned to this batch
+    #
+    # Returns the usages and a mask of the paths the snapshot holds.
+
+    def previous(self, snapshot):
+        missing = [self.MISSING, 0]
+        previous = np.fromiter((snapshot.get(path, missing)[0] for path in self.paths),
+                               dtype=np.int64, count=len(self.paths))
+        return previous, previous != self.MISSING
+
+    # changes - Usage change against a snapshot
+    #
+    # A path the snapshot does not hold grew by its whole usage, unless "missing" is
+    # given, in which case those changes are NaN.
+
+    def changes(self, snapshot, missing=None):
+        previous, present = self.previous(snapshot)
+        changes = self.usages - np.where(present, previous, 0)
+        if missing is None:
+            return changes.astype(np.float64), present
+        return np.where(present, changes, missing).astype(np.float64), present
+
+    # ratios - Usage as a percentage of the limit, 0 for quotas without a limit
+
+    def ratios(self):
+        limits = np.where(self.limits > 0, self.limits, 1)
+        return np.where(self.limits > 0, self.usages * 100.0 / limits, 0.0)
+
+    # snapshot - The batch as {path: [usage, limit]} for the history store
+
+    def snapshot(self):
+        return {path: [usage, limit] for path, usage, limit in
+                zip(self.paths, self.usages.tolist(), self.limits.tolist())}
+
+    @staticmethod
+    def gb(values):
+        return np.round(np.asarray(values) / GB, 2)
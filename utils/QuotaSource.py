@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# QuotaSource.py
+#
+# Streams the directory quotas of a Qumulo cluster page by page
+
+# Import Python system libraries
+import queue
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+
+from utils import Metrics
+from utils.QuotaBatch import QuotaBatch
+
+# A single quota as it is used by the reporting code. Usage and limit are bytes.
+QuotaRecord = namedtuple("QuotaRecord", ["path", "usage", "limit"])
+
+
+#
+# QuotaSource Class
+#
+# This class walks the "/v1/files/quotas/status/" API by following the "paging.next"
+# link of every response. Only one page is held in memory at a time, so the caller
+# can feed diffing and rendering directly from it no matter how many quotas exist.
+
+
+class QuotaSource(object):
+    QUOTA_STATUS_URI = "/v1/files/quotas/status/"
+    DEFAULT_PAGE_SIZE = 1000
+
+    def __init__(self, rc, page_size=DEFAULT_PAGE_SIZE, page_sizer=None, logger=None):
+
+        # Store the RestClient that we will page through
+        self.rc = rc
+
+        # Store the number of quotas requested per page
+        self.page_size = page_size
+
+        # Store the optional AdaptivePageSizer that tunes the page size while walking
+        self.page_sizer = page_sizer
+
+        # Store the logger..
+        self.logger = logger
+
+        # Counters of the last walk
+        self.page_count = 0
+        self.quota_count = 0
+        self.fetch_seconds = 0.0
+
+    # first_page_uri - Build the uri of the first quota page
+
+    def first_page_uri(self):
+        return f'{self.QUOTA_STATUS_URI}?{urlencode({"limit": self.page_size})}'
+
+    # fetch_page - Get a single raw page of quotas from the cluster
+
+    def fetch_page(self, uri):
+        return self.rc.request("GET", uri)
+
+    # with_page_size - Replace the "limit" query parameter of a paging uri
+
+    @staticmethod
+    def with_page_size(uri, page_size):
+        parts = urlsplit(uri)
+        query = [(key, value) for key, value in parse_qsl(parts.query) if key != "limit"]
+        query.append(("limit", page_size))
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    # raw_pages - Yield the raw API responses one by one until there is no next page
+
+    def raw_pages(self):
+        self.page_count = 0
+        self.fetch_seconds = 0.0
+        if self.page_sizer is not None:
+            self.page_size = self.page_sizer.page_size
+        next_page = self.first_page_uri()
+        while next_page:
+            start = time.monotonic()
+            page = self.fetch_page(next_page)
+            elapsed = time.monotonic() - start
+            self.fetch_seconds += elapsed
+            if not page:
+                break
+            self.page_count += 1
+            # The RestClient only returns the decoded page, so its size is estimated
+            quotas = page.get("quotas", [])
+            Metrics.current().record("page_fetch", elapsed, rows=len(quotas),
+                                     bytes=AdaptivePageSizer.estimate_bytes(quotas))
+            if self.logger is not None:
+                self.logger.debug(f'Got quota page {self.page_count} from {next_page} in {elapsed:.3f}s')
+
+            next_page = page.get("paging", {}).get("next", "")
+            if next_page and self.page_sizer is not None:
+                self.resize(page, elapsed)
+                next_page = self.with_page_size(next_page, self.page_size)
+            yield page
+
+    # resize - Let the page sizer pick the size of the next page from the timing of this one
+
+    def resize(self, page, elapsed):
+        quotas = page.get("quotas", [])
+        payload_bytes = self.page_sizer.estimate_bytes(quotas)
+        new_size = self.page_sizer.next_size(len(quotas), elapsed, payload_bytes)
+        if self.logger is not None:
+            message = (f'Quota page {self.page_count}: {len(quotas)} quotas, ~{payload_bytes} bytes '
+                       f'in {elapsed:.3f}s, next page size {new_size}')
+            if new_size != self.page_size:
+                self.logger.info(message)
+            else:
+                self.logger.debug(message)
+        self.page_size = new_size
+
+    # pages - Yield every page as a list of QuotaRecord
+
+    def pages(self):
+        self.quota_count = 0
+        for page in self.raw_pages():
+            records = [self.to_record(quota) for quota in page.get("quotas", [])]
+            self.quota_count += len(records)
+            yield records
+
+    # batches - Yield every page as a columnar QuotaBatch
+
+    def batches(self):
+        self.quota_count = 0
+        for page in self.raw_pages():
+            batch = QuotaBatch.from_quotas(page.get("quotas", []))
+            self.quota_count += len(batch)
+            yield batch
+
+    # to_record - Convert a quota of the API to a QuotaRecord
+
+    @staticmethod
+    def to_record(quota):
+        return QuotaRecord(quota["path"], int(quota["capacity_usage"]), int(quota["limit"]))
+
+    def __iter__(self):
+        for records in self.pages():
+            yield from records
+
+
+#
+# AdaptivePageSizer Class
+#
+# Picks the size of the next quota page from the latency and payload size of the
+# previous one. Pages grow while the cluster answers quickly and shrink when it is
+# loaded, each step at most by a factor of two and always within [min_size, max_size].
+
+
+class AdaptivePageSizer(object):
+    DEFAULT_TARGET_SECONDS = 0.5
+    DEFAULT_TARGET_BYTES = 4 * 1024 * 1024
+    MIN_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 10000
+
+    # Rough size of the JSON of a single quota, without its path
+    QUOTA_OVERHEAD_BYTES = 96
+
+    def __init__(self, page_size=QuotaSource.DEFAULT_PAGE_SIZE, target_seconds=DEFAULT_TARGET_SECONDS,
+                 target_bytes=DEFAULT_TARGET_BYTES, min_size=MIN_PAGE_SIZE, max_size=MAX_PAGE_SIZE):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.page_size = self.clamp(page_size)
+
+    def clamp(self, page_size):
+        return int(min(self.max_size, max(self.min_size, page_size)))
+
+    # estimate_bytes - Estimate the response size of a page without encoding it again
+
+    @classmethod
+    def estimate_bytes(cls, quotas):
+        return sum(len(quota["path"]) for quota in quotas) + cls.QUOTA_OVERHEAD_BYTES * len(quotas)
+
+    # next_size - Scale the page size toward both the latency and the payload target
+
+    def next_size(self, quota_count, seconds, payload_bytes):
+        if quota_count == 0:
+            return self.page_size
+
+        factor = 2.0
+        if seconds > 0:
+            factor = min(factor, self.target_seconds / seconds)
+        if payload_bytes > 0:
+            factor = min(factor, self.target_bytes / payload_bytes)
+        factor = max(0.5, factor)
+
+        # A short page (usually the last one) tells nothing about a bigger one
+        if quota_count < self.page_size and factor > 1.0:
+            return self.page_size
+
+        self.page_size = self.clamp(quota_count * factor)
+        return self.page_size
+
+
+#
+# PrefetchingQuotaSource Class
+#
+# Same as QuotaSource, but a background thread keeps up to "prefetch_depth" pages
+# in flight while the caller is still diffing and rendering the previous one. The
+# time spent on requests that the caller did not have to wait for is reported as
+# hidden time once the walk is over.
+
+
+class PrefetchingQuotaSource(QuotaSource):
+    DEFAULT_PREFETCH_DEPTH = 2
+
+    # Marker put on the queue once the producer thread has no more pages
+    _DONE = object()
+
+    def __init__(self, rc, page_size=QuotaSource.DEFAULT_PAGE_SIZE, page_sizer=None,
+                 prefetch_depth=DEFAULT_PREFETCH_DEPTH, logger=None):
+        super().__init__(rc, page_size=page_size, page_sizer=page_sizer, logger=logger)
+
+        # Store how many pages may be fetched ahead of the caller
+        self.prefetch_depth = max(1, int(prefetch_depth))
+
+        # Time the caller spent blocked on the next page, and the time hidden behind it
+        self.wait_seconds = 0.0
+        self.hidden_seconds = 0.0
+
+    # produce - Fetch the pages on the background thread, handing each to "put"
+    #
+    # put returns False once the caller has stopped reading.
+
+    def produce(self, put):
+        for page in QuotaSource.raw_pages(self):
+            if not put(page):
+                return
+
+    # raw_pages - Yield the raw API responses while the next ones are fetched in the background
+
+    def raw_pages(self):
+        pages = queue.Queue(maxsize=self.prefetch_depth)
+        stop = threading.Event()
+
+        def put(item):
+            # Never block forever on a full queue if the caller has gone away
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def producer():
+            try:
+                self.produce(put)
+            except Exception as err:
+                put(err)
+            finally:
+                put(self._DONE)
+
+        self.wait_seconds = 0.0
+        self.hidden_seconds = 0.0
+        worker = threading.Thread(target=producer, name="QuotaPrefetch", daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                start = time.monotonic()
+                item = pages.get()
+                self.wait_seconds += time.monotonic() - start
+                if item is self._DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            worker.join()
+            self.hidden_seconds = max(0.0, self.fetch_seconds - self.wait_seconds)
+            if self.logger is not None:
+                self.logger.info(f'Fetched {self.page_count} quota pages in {self.fetch_seconds:.2f}s, '
+                                 f'{self.hidden_seconds:.2f}s of it hidden behind processing')
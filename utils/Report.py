@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Report.py
+#
+# Streaming HTML writer for the directory trend report
+
+# Import Python system libraries
+import csv
+import heapq
+import io
+import os
+import tempfile
+import threading
+from html import escape
+
+
+#
+# ReportWriter Class
+#
+# Writes the report straight to a text stream (a file, a temporary file or a
+# StringIO) one row at a time, so no document tree is built in memory. Cells are
+# styled through the classes of a single <style> block instead of an inline style
+# on every cell, which keeps the report a fraction of the size.
+
+
+class ReportWriter(object):
+    STYLE = (
+        "table{border-collapse:collapse}"
+        "th,td{padding:2px 8px}"
+        ".l{text-align:left}"
+        ".c{text-align:center}"
+    )
+
+    def __init__(self, out):
+
+        # Store the stream that the report is written to
+        self.out = out
+
+        # Number of rows written so far, not counting the header
+        self.row_count = 0
+
+    # begin_document - Write everything before the first table
+
+    def begin_document(self, title):
+        self.out.write("<!DOCTYPE html>\n<html>\n<head>\n")
+        self.out.write(f"<title>{escape(title)}</title>\n")
+        self.out.write(f"<style>{self.STYLE}</style>\n")
+        self.out.write("</head>\n<body>\n")
+
+    # heading - Write a heading, e.g. the name of a cluster
+
+    def heading(self, text):
+        self.out.write(f"<h2>{escape(str(text))}</h2>\n")
+
+    # paragraph - Write a line of text
+
+    def paragraph(self, text):
+        self.out.write(f"<p>{escape(str(text))}</p>\n")
+
+    # begin_table - Open a table and write its header row
+    #
+    # The first column is left aligned, all the others are centered.
+
+    def begin_table(self, columns):
+        self.out.write("<table>\n<tr>")
+        for index, column in enumerate(columns):
+            self.out.write(f'<th class="{self.align(index)}"><span>{escape(str(column))}</span></th>')
+        self.out.write("</tr>\n")
+
+    # row - Write a single table row
+
+    def row(self, cells):
+        self.out.write("<tr>")
+        for index, cell in enumerate(cells):
+            self.out.write(f'<td class="{self.align(index)}"><span>{escape(str(cell))}</span></td>')
+        self.out.write("</tr>\n")
+        self.row_count += 1
+
+    def end_table(self):
+        self.out.write("</table>\n")
+
+    def end_document(self):
+        self.out.write("</body>\n</html>\n")
+
+    @staticmethod
+    def align(index):
+        return "l" if index == 0 else "c"
+
+
+#
+# CsvReportWriter Class
+#
+# The same interface as ReportWriter, writing CSV instead of HTML, for reports that
+# are attached rather than shown inline. The document and the tables have no markup
+# of their own; a heading becomes a row of its own, preceded by an empty line when
+# it is not the first.
+
+
+class CsvReportWriter(object):
+    def __init__(self, out):
+        self.out = out
+        self.writer = csv.writer(out)
+        self.row_count = 0
+        self.__started = False
+
+    def begin_document(self, title):
+        pass
+
+    def heading(self, text):
+        if self.__started:
+            self.writer.writerow([])
+        self.writer.writerow([text])
+        self.__started = True
+
+    def begin_table(self, columns):
+        self.writer.writerow(columns)
+        self.__started = True
+
+    def row(self, cells):
+        self.writer.writerow(cells)
+        self.row_count += 1
+
+    def end_table(self):
+        pass
+
+    def end_document(self):
+        pass
+
+
+# Report writers by attachment format
+REPORT_WRITERS = {
+    "html": ReportWriter,
+    "csv": CsvReportWriter,
+}
+
+
+#
+# TopRows Class
+#
+# Keeps the "size" rows with the largest keys while the rows stream by, in a heap
+# of at most "size" entries, so the memory used does not depend on the number of
+# rows. Rows with equal keys are kept in the order they arrived. The cells may be
+# given as a function that returns them, which is only called for a row that is
+# kept.
+
+
+class TopRows(object):
+    def __init__(self, size):
+        self.size = size
+        self.row_count = 0
+        self.__heap = []
+
+    # add - Offer a row; returns its cells, which are only computed if the row is kept
+
+    def add(self, key, cells):
+        self.row_count += 1
+        if len(self.__heap) < self.size:
+            replace = False
+        elif self.__heap and key > self.__heap[0][0]:
+            replace = True
+        else:
+            return cells
+
+        if callable(cells):
+            cells = cells()
+        entry = (key, -self.row_count, cells)
+        if replace:
+            heapq.heapreplace(self.__heap, entry)
+        else:
+            heapq.heappush(self.__heap, entry)
+        return cells
+
+    # rows - The rows kept, largest key first
+
+    def rows(self):
+        return [cells for _, _, cells in sorted(self.__heap, reverse=True)]
+
+
+#
+# ReportTable Class
+#
+# A table of the report written to a temporary file with one of the report writers.
+# With "top", only the rows with the largest selection keys are kept, in a TopRows,
+# and written largest first when the table is finished; otherwise every row is
+# written as it arrives. With "summary_rows", the rows with the largest growth are
+# also kept for the summary of an attached report.
+
+
+class ReportTable(object):
+    def __init__(self, columns, writer_class=ReportWriter, top=None, summary_rows=None, out=None):
+        # The table is written to a temporary file of its own unless "out" is given,
+        # e.g. a SpooledTableFile
+        self.file = out if out is not None else tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="")
+        self.writer = writer_class(self.file)
+        self.writer.begin_table(columns)
+        self.top = TopRows(top) if top is not None else None
+        self.summary = TopRows(summary_rows) if summary_rows is not None else None
+
+    # row - Add a row, given as cells or as a function returning them
+
+    def row(self, cells, key=0, growth=0):
+        if self.top is not None:
+            cells = self.top.add(key, cells)
+        else:
+            if callable(cells):
+                cells = cells()
+            self.writer.row(cells)
+        if self.summary is not None:
+            self.summary.add(growth, cells)
+
+    # finish - Write the selected rows and close the table; returns (file, summary), rewound
+
+    def finish(self):
+        if self.top is not None:
+            for cells in self.top.rows():
+                self.writer.row(cells)
+        self.writer.end_table()
+        self.file.seek(0)
+        return self.file, self.summary
+
+
+#
+# TableSpool Class
+#
+# One temporary file shared by the tables of many recipients, so that hundreds of
+# owner tables do not hold hundreds of open files. Every table collects its text in
+# memory and appends it to the spool in segments of SEGMENT_SIZE, remembering only
+# their offsets. Segments are read back with os.pread, so tables can be read from
+# several threads at once. The file is closed once the spool and all its tables
+# are.
+
+
+class TableSpool(object):
+    SEGMENT_SIZE = 16 * 1024
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(buffering=0)
+        self.size = 0
+        self.__lock = threading.Lock()
+        self.__users = 1
+
+    # table_file - A new text file for a table, stored in this spool
+
+    def table_file(self):
+        with self.__lock:
+            self.__users += 1
+        return SpooledTableFile(self)
+
+    # append - Store a segment; returns its (offset, length)
+
+    def append(self, data):
+        with self.__lock:
+            offset = self.size
+            self.file.write(data)
+            self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset, length):
+        return os.pread(self.file.fileno(), length, offset)
+
+    # close - Release the spool or one of its tables; the last one closes the file
+
+    def close(self):
+        with self.__lock:
+            self.__users -= 1
+            if self.__users == 0:
+                self.file.close()
+
+
+#
+# SpooledTableFile Class
+#
+# The text file of a table in a TableSpool. It is written like a file, rewound
+# with seek(0) and then read back, like the temporary file of a ReportTable.
+
+
+class SpooledTableFile(object):
+    def __init__(self, spool):
+        self.spool = spool
+        self.segments = []
+        self.buffer = io.StringIO()
+        self.__next = 0
+        self.__closed = False
+
+    def write(self, text):
+        self.buffer.write(text)
+        if self.buffer.tell() >= TableSpool.SEGMENT_SIZE:
+            self.segments.append(self.spool.append(self.buffer.getvalue().encode("utf-8")))
+            self.buffer = io.StringIO()
+
+    # seek - Rewind to the start; a table is only ever read from the beginning
+
+    def seek(self, position):
+        if position != 0:
+            raise ValueError("A spooled table can only be rewound to its start")
+        self.__next = 0
+
+    # read - The next segment of the table, or everything that is left if size < 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return "".join(iter(lambda: self.read(1), ""))
+        index = self.__next
+        if index > len(self.segments):
+            return ""
+        self.__next += 1
+        if index == len(self.segments):
+            return self.buffer.getvalue()
+        return self.spool.read(*self.segments[index]).decode("utf-8")
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.segments = []
+            self.buffer = io.StringIO()
+            self.spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Routing.py
+#
+# Routes the rows of the report to the owners of the directories
+
+#  Import local Python libraries
+from utils.Report import TableSpool
+
+
+#
+# RouteTable Class
+#
+# Maps path prefixes to the recipients that own them, from the "routes" list of the
+# configuration. The prefixes are kept in a dict, so finding the owners of a path
+# means probing each of its ancestors ("/", "/projects/", "/projects/x/", ...) once,
+# independent of the number of routes. A path belongs to every route above it.
+
+
+class RouteTable(object):
+    def __init__(self, routes):
+        self.prefixes = {}
+        for route in routes:
+            prefix = route["prefix"]
+            if not prefix.endswith("/"):
+                prefix += "/"
+            recipients = route["to"]
+            if isinstance(recipients, str):
+                recipients = [recipients]
+            self.prefixes.setdefault(prefix, set()).update(recipients)
+
+    def __bool__(self):
+        return bool(self.prefixes)
+
+    # recipients - All recipients of the routes above a path
+
+    def recipients(self, path):
+        found = set()
+        index = path.find("/") + 1
+        while index > 0:
+            owners = self.prefixes.get(path[:index])
+            if owners:
+                found |= owners
+            index = path.find("/", index) + 1
+        if not path.endswith("/"):
+            found |= self.prefixes.get(path + "/", set())
+        return found
+
+
+#
+# OwnerReports Class
+#
+# One report table per recipient, each a ReportTable made by new_table(out) when the
+# first row of the recipient is routed, so the tables are partitioned in the same
+# single pass that writes the full report. All of them are written to a single
+# TableSpool, so the number of recipients does not add open files.
+
+
+class OwnerReports(object):
+    def __init__(self, route_table, new_table):
+        self.route_table = route_table
+        self.new_table = new_table
+        self.spool = TableSpool()
+        self.__tables = {}
+
+    # row - Add a row to the table of every owner of the directory
+    #
+    # The cells may be given as a function returning them, as for ReportTable.row.
+
+    def row(self, directory, cells, key=0, growth=0):
+        recipients = self.route_table.recipients(directory)
+        if not recipients:
+            return
+        if callable(cells):
+            cells = cells()
+        for recipient in recipients:
+            if recipient not in self.__tables:
+                self.__tables[recipient] = self.new_table(self.spool.table_file())
+            self.__tables[recipient].row(cells, key, growth)
+
+    # files - Finish the tables and return them as {recipient: (file, summary)}, rewound
+
+    def files(self):
+        files = {recipient: table.finish() for recipient, table in self.__tables.items()}
+        self.__tables = {}
+        # The spool stays open until the tables are closed
+        self.spool.close()
+        return files
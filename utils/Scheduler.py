@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Scheduler.py
+#
+# Interval and cron-expression schedules for the daemon mode
+
+# Import Python system libraries
+import time
+from datetime import datetime, timedelta
+
+
+#
+# IntervalSchedule Class
+#
+# Runs every "interval" seconds, aligned to multiples of the interval so that the
+# runs do not drift by the time each run takes.
+
+
+class IntervalSchedule(object):
+    def __init__(self, interval):
+        if interval <= 0:
+            raise ValueError("The interval must be a positive number of seconds")
+        self.interval = interval
+
+    # next_run - Epoch time of the first run strictly after "after"
+
+    def next_run(self, after):
+        return (int(after // self.interval) + 1) * self.interval
+
+    def __str__(self):
+        return f'every {self.interval} seconds'
+
+
+#
+# CronSchedule Class
+#
+# Runs at the times matched by a 5 field cron expression (minute, hour, day of month,
+# month, day of week) in local time. Every field accepts "*", numbers, ranges, lists
+# and steps, and month and day of week also accept names, as described in README.md.
+# As in cron, if both day fields are restricted a day matching either of them runs
+# (a day field starting with "*" counts as unrestricted, "*/2" included), and both
+# 0 and 7 mean Sunday.
+
+
+class CronSchedule(object):
+    MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+    DAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+    # (low, high, names) of every field
+    FIELDS = [
+        (0, 59, None),
+        (0, 23, None),
+        (1, 31, None),
+        (1, 12, MONTHS),
+        (0, 7, DAYS),
+    ]
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'"{expression}" must have 5 fields: minute hour day month weekday')
+
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = [
+            self.parse_field(field, low, high, names) for field, (low, high, names) in zip(fields, self.FIELDS)
+        ]
+        self.weekdays = {weekday % 7 for weekday in self.weekdays}
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+
+    # parse_field - Expand a single cron field into the set of values it matches
+
+    @classmethod
+    def parse_field(cls, field, low, high, names):
+        values = set()
+        for part in field.lower().split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/", 1)
+                step = int(step)
+                if step <= 0:
+                    raise ValueError(f'Invalid step in cron field "{field}"')
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = [cls.parse_value(value, names) for value in part.split("-", 1)]
+            else:
+                start = cls.parse_value(part, names)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f'Cron field "{field}" is out of range {low}-{high}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    @staticmethod
+    def parse_value(value, names):
+        if names is not None and value[:3] in names:
+            return names.index(value[:3]) + (1 if len(names) == 12 else 0)
+        return int(value)
+
+    # day_matches - Cron semantics for the day of month and day of week fields
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    # next_run - Epoch time of the first matching minute strictly after "after"
+
+    def next_run(self, after):
+        moment = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f'"{self.expression}" never matches')
+
+    def __str__(self):
+        return f'at "{self.expression}"'
+
+
+# run_forever - Call "job" at every time of the schedule until interrupted
+#
+# A failing run is logged and the schedule carries on with the next one.
+
+def run_forever(schedule, job, logger=None):
+    if logger is not None:
+        logger.info(f'Daemon started, running {schedule}')
+    try:
+        while True:
+            next_run = schedule.next_run(time.time())
+            if logger is not None:
+                logger.info(f'Next run at {datetime.fromtimestamp(next_run)}')
+            while time.time() < next_run:
+                time.sleep(min(60, max(0.0, next_run - time.time())))
+            try:
+                job()
+            except Exception as err:
+                if logger is not None:
+                    logger.error(f'Scheduled run failed, error is {err}')
+    except KeyboardInterrupt:
+        if logger is not None:
+            logger.info('Daemon stopped')
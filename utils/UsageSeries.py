@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2022 Qumulo
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# UsageSeries.py
+#
+# The recent usage samples of every quota as one NumPy matrix
+
+# Import Python system libraries
+import os
+
+import numpy as np
+
+#  Import local Python libraries
+from utils.AtomicFile import atomic_write
+from utils.History import DAY
+
+
+#
+# UsageSeries Class
+#
+# Keeps the last "window" daily samples of the usage history as a matrix with one
+# row per quota path and one column per sample, in a single .npz file next to the
+# history. A run loads that one file and appends its own column, instead of reading
+# every snapshot of the history again; missing samples are NaN. A run less than
+# SPACING after the last sample is not added, so the window spans about "window"
+# days however often the report runs.
+#
+# The file is caught up with the history store when it is loaded, so it is built
+# from the existing snapshots on first use and repaired after a run that did not
+# save it.
+
+
+class UsageSeries(object):
+    FILE_NAME = "series.npz"
+    DEFAULT_WINDOW = 90
+
+    # A daily run that starts a little earlier than the day before still counts
+    SPACING = DAY - 60 * 60
+
+    def __init__(self, history_dir, window=DEFAULT_WINDOW, logger=None):
+
+        # Store the file of the series and the number of samples kept
+        self.series_path = os.path.join(history_dir, self.FILE_NAME)
+        self.window = window
+        self.modified = False
+
+        # Store the logger..
+        self.logger = logger
+
+        self.paths = []
+        self.index = {}
+        self.timestamps = np.empty(0, dtype=np.float64)
+        self.usages = np.empty((0, 0), dtype=np.float64)
+
+    # load - Read the series file and append the snapshots of the history it is missing
+
+    def load(self, history):
+        if os.path.exists(self.series_path):
+            with np.load(self.series_path, allow_pickle=False) as series:
+                self.paths = self.decode_paths(series["paths"])
+                self.timestamps = series["timestamps"]
+                self.usages = series["usages"]
+            self.index = {path: row for row, path in enumerate(self.paths)}
+
+        missing = self.spaced(history.timestamps())[-self.window:]
+        if missing:
+            snapshots = history.load_many(missing)
+            self.extend([(snapshots[ts], ts) for ts in missing])
+        if missing and self.logger is not None:
+            self.logger.debug(f'Added {len(missing)} snapshots of the history to {self.series_path}')
+        return self
+
+    # samples - (timestamps, usages) of the given paths, one row per path
+    #
+    # A path that is not in the series gets a row of NaN.
+
+    def samples(self, paths):
+        rows = np.fromiter((self.index.get(path, -1) for path in paths), dtype=np.int64, count=len(paths))
+        usages = np.full((len(paths), len(self.timestamps)), np.nan)
+        known = rows >= 0
+        usages[known] = self.usages[rows[known]]
+        return self.timestamps, usages
+
+    # spaced - The timestamps that are at least SPACING after the last sample and each other
+
+    def spaced(self, timestamps):
+        last = self.timestamps[-1] if len(self.timestamps) else None
+        spaced = []
+        for ts in timestamps:
+            if last is None or ts - last >= self.SPACING:
+                spaced.append(ts)
+                last = ts
+        return spaced
+
+    # append - Add the snapshot {path: [usage, limit]} taken at "ts" as a new column
+
+    def append(self, quotas, ts):
+        self.extend([(quotas, ts)])
+
+    # extend - Add a list of (snapshot, ts), oldest first, as new columns
+    #
+    # Snapshots closer than SPACING to the previous sample are left out. The oldest
+    # columns are dropped once the window is full, together with the paths that
+    # have no sample left.
+
+    def extend(self, snapshots):
+        spaced = set(self.spaced([ts for _, ts in snapshots]))
+        snapshots = [(quotas, ts) for quotas, ts in snapshots if ts in spaced]
+        if not snapshots:
+            return
+        self.modified = True
+        for quotas, _ in snapshots:
+            for path in quotas:
+                if path not in self.index:
+                    self.index[path] = len(self.paths)
+                    self.paths.append(path)
+
+        kept = min(self.usages.shape[1], self.window - min(len(snapshots), self.window))
+        snapshots = snapshots[-self.window:]
+        usages = np.full((len(self.paths), kept + len(snapshots)), np.nan)
+        if kept:
+            usages[:self.usages.shape[0], :kept] = self.usages[:, self.usages.shape[1] - kept:]
+        for column, (quotas, _) in enumerate(snapshots, start=kept):
+            rows = np.fromiter((self.index[path] for path in quotas), dtype=np.int64, count=len(quotas))
+            usages[rows, column] = np.fromiter((usage for usage, _ in quotas.values()),
+                                               dtype=np.float64, count=len(quotas))
+        self.usages = usages
+        self.timestamps = np.append(self.timestamps[len(self.timestamps) - kept:],
+                                    [float(ts) for _, ts in snapshots])
+
+        alive = ~np.isnan(self.usages).all(axis=1)
+        if not alive.all():
+            self.paths = [path for path, keep in zip(self.paths, alive.tolist()) if keep]
+            self.index = {path: row for row, path in enumerate(self.paths)}
+            self.usages = self.usages[alive]
+
+    # save - Write the series under a temporary name and rename it into place, if it changed
+
+    def save(self):
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(self.series_path), exist_ok=True)
+        with atomic_write(self.series_path, "wb") as seriesFile:
+            np.savez(seriesFile, paths=self.encode_paths(self.paths),
+                     timestamps=self.timestamps, usages=self.usages)
+        self.modified = False
+
+    # The paths are stored as one NUL separated UTF-8 buffer, which no path can
+    # contain, instead of a fixed width string array as wide as the longest path
+
+    @staticmethod
+    def encode_paths(paths):
+        return np.frombuffer("\0".join(paths).encode("utf-8"), dtype=np.uint8)
+
+    @staticmethod
+    def decode_paths(buffer):
+        text = buffer.tobytes().decode("utf-8")
+        return text.split("\0") if text else []